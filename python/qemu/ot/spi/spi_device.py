@@ -76,6 +76,7 @@ def __init__(self):
         self._4ben = False
         self._rev_rx = False
         self._rev_tx = False
+        self._pending: list[tuple[int, int]] = []
 
     def connect(self, host: str, port: int) -> None:
         """Open a TCP connection to the remote host.
@@ -102,7 +103,8 @@ def quit(self) -> None:
             self._socket = None
 
     def transmit(self, cmd: Optional[int] = None,
-                 in_payload: Optional[bytes | bytearray | int] = None,
+                 in_payload: Optional[bytes | bytearray | memoryview |
+                                      int] = None,
                  out_len: int = 0, release: bool = True) -> bytes:
         """SPI data transfer.
 
@@ -111,26 +113,59 @@ def transmit(self, cmd: Optional[int] = None,
            :param out_len: the count of meaningful bytes to receive
            :param release: whether to release /CS line (to manage transactions)
         """
-        if isinstance(in_payload, int):
-            in_payload = bytes([0xff] * in_payload)
-        elif in_payload is not None:
-            assert isinstance(in_payload, (bytes, bytearray))
-        else:
-            in_payload = bytes()
-        assert isinstance(out_len, int) and 0 <= out_len <= 0xffff
-        if cmd is not None:
-            assert 0 <= cmd <= 0xff
-            tx_payload = b''.join((bytes([cmd]), in_payload, bytes(out_len)))
-        else:
-            tx_payload = b''.join((in_payload, bytes(out_len)))
-        if self._rev_tx:
-            tx_payload = bytes(SpiDevice.rev8(x) for x in tx_payload)
+        if self._pending:
+            raise RuntimeError('Submitted transfers should be drained first')
+        tx_payload = self._build_tx_payload(cmd, in_payload, out_len)
         rx_payload = self._exchange(tx_payload, release)
         if self._rev_rx:
             rx_payload = bytes(SpiDevice.rev8(x) for x in rx_payload)
         assert len(rx_payload) == len(tx_payload)
         return rx_payload[-out_len:]
 
+    def submit(self, cmd: Optional[int] = None,
+               in_payload: Optional[bytes | bytearray | memoryview |
+                                    int] = None,
+               out_len: int = 0, release: bool = True) -> None:
+        """SPI data transfer, without waiting for the remote response.
+
+           Responses of submitted transfers are retrieved with drain(), which
+           allows sending several requests in a single round trip.
+
+           :param cmd: the command to send
+           :param in_payload: the payload to send
+           :param out_len: the count of meaningful bytes to receive
+           :param release: whether to release /CS line (to manage transactions)
+        """
+        tx_payload = self._build_tx_payload(cmd, in_payload, out_len)
+        self._send(tx_payload, release)
+        self._pending.append((len(tx_payload), out_len))
+
+    def drain(self) -> list[bytes]:
+        """Retrieve the responses of all the submitted transfers.
+
+           :return: the meaningful received bytes of each submitted transfer,
+                    in submission order
+        """
+        if not self._pending:
+            return []
+        txlen = sum(size for size, _ in self._pending)
+        try:
+            resp = self._receive(txlen)
+        finally:
+            pending = self._pending
+            self._pending = []
+        rxlen = len(resp)
+        if rxlen != txlen:
+            raise RuntimeError(f'Response truncated {rxlen}/{txlen}')
+        if self._rev_rx:
+            resp = bytes(SpiDevice.rev8(x) for x in resp)
+        payloads = []
+        pos = 0
+        for size, out_len in pending:
+            pos += size
+            payloads.append(resp[pos-out_len:pos])
+        return payloads
+
     def read_status_register(self) -> int:
         """Read out the flash status register."""
         resp = self.transmit(self.COMMANDS['READ_STATUS'], out_len=1)
@@ -148,21 +183,26 @@ def is_wel(self, sreg: Optional[int] = None) -> bool:
             sreg = self.read_status_register()
         return bool(sreg & self.WEL)
 
-    def wait_idle(self, timeout: float = 1.0, pace: float = 0.0005):
+    def wait_idle(self, timeout: float = 1.0, pace: float = 0.0005,
+                  min_pace: Optional[float] = None):
         """Wait for the flash device to become idle.
 
            :param timeout: raise a TimeoutError if flash does not become
                            available after this delay
            :param pace: delay between each flash device poll request.
+           :param min_pace: if defined, initial delay between poll requests,
+                            doubled after each poll request up to pace
         """
         timeout += now()
+        delay = pace if min_pace is None else min(min_pace, pace)
         while True:
             status = self.read_status_register()
             if not status & self.BUSY:
                 break
             if now() > timeout:
                 raise TimeoutError('Flash stuck to busy')
-            sleep(pace)
+            sleep(delay)
+            delay = min(delay * 2, pace)
 
     def read_jedec_id(self) -> bytes:
         """Read out the flash device JEDEC ID."""
@@ -194,18 +234,29 @@ def enable_4b_address(self, enable: bool):
         self.transmit(self.COMMANDS['ENTER_ADDR4' if enable else 'EXIT_ADDR4'])
         self._4ben = enable
 
-    def page_program(self, address: int, buffer: bytes):
+    def page_program(self, address: int,
+                     buffer: bytes | bytearray | memoryview,
+                     enable_write: bool = False):
         """Program a page (usually 256 bytes) into the flash device.
 
            :param address: address of the first byte to program
            :param buffer: the page content
+           :param enable_write: whether to enable write first, both requests
+                                being sent in a single round trip
         """
         addr = spack('>I', address)
         if not self.is_4b_addr:
             if address >= (1 << 24):
                 raise ValueError('Cannot encode address')
             addr = addr[1:]
-        self.transmit(self.COMMANDS['PAGE_PROGRAM'], b''.join((addr, buffer)))
+        if enable_write:
+            self.submit(self.COMMANDS['WRITE_ENABLE'])
+            self.submit(self.COMMANDS['PAGE_PROGRAM'],
+                        b''.join((addr, buffer)))
+            self.drain()
+        else:
+            self.transmit(self.COMMANDS['PAGE_PROGRAM'],
+                          b''.join((addr, buffer)))
 
     def power_down(self):
         """Power down the device (may trigger a QEMU shurtdown)."""
@@ -308,6 +359,26 @@ def _build_cs_header(self, size: int, release: bool = True) -> bytes:
         self._log.debug('Header: %s', hexlify(header).decode())
         return header
 
+    def _build_tx_payload(self, cmd: Optional[int],
+                          in_payload: Optional[bytes | bytearray |
+                                               memoryview | int],
+                          out_len: int) -> bytes:
+        if isinstance(in_payload, int):
+            in_payload = bytes([0xff] * in_payload)
+        elif in_payload is not None:
+            assert isinstance(in_payload, (bytes, bytearray, memoryview))
+        else:
+            in_payload = bytes()
+        assert isinstance(out_len, int) and 0 <= out_len <= 0xffff
+        if cmd is not None:
+            assert 0 <= cmd <= 0xff
+            tx_payload = b''.join((bytes([cmd]), in_payload, bytes(out_len)))
+        else:
+            tx_payload = b''.join((in_payload, bytes(out_len)))
+        if self._rev_tx:
+            tx_payload = bytes(SpiDevice.rev8(x) for x in tx_payload)
+        return tx_payload
+
     def _send(self, buf: bytes, release: bool = True):
         data = b''.join((self._build_cs_header(len(buf), release), buf))
         self._log.debug('TX[%d]: %s %s', len(buf), hexlify(buf).decode(),
@@ -10,10 +10,18 @@
 
 from argparse import ArgumentParser, FileType, Namespace
 from atexit import register
-from collections import defaultdict, deque
+from collections import ChainMap, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from csv import reader as csv_reader, writer as csv_writer
-from fnmatch import fnmatchcase
-from glob import glob
+from fnmatch import translate
+from functools import lru_cache
+from glob import iglob
+try:
+    # only available from Python 3.13+
+    from glob import translate as glob_translate
+except ImportError:
+    glob_translate = None
+from itertools import chain
 try:
     _HJSON_ERROR = None
     from hjson import load as jload
@@ -22,10 +30,13 @@
     def hjload(*_, **__):  # noqa: E301
         """dummy func if HJSON module is not available"""
         return {}
-from os import close, curdir, environ, getcwd, linesep, pardir, sep, unlink
+from os import (O_RDONLY, close, curdir, environ, getcwd, linesep,
+                open as os_open, pardir, read, sep, stat, unlink)
 from os.path import (abspath, basename, dirname, exists, isabs, isdir, isfile,
                      join as joinpath, normpath, relpath)
 from select import POLLIN, POLLERR, POLLHUP, poll as spoll
+from selectors import DefaultSelector, EVENT_READ
+from shlex import split as shsplit
 from shutil import rmtree
 from socket import socket, timeout as LegacyTimeoutError
 from subprocess import Popen, PIPE, TimeoutExpired
@@ -39,8 +50,8 @@ def hjload(*_, **__):  # noqa: E301
 import re
 import sys
 
-QEMU_PYPATH = joinpath(dirname(dirname(dirname(normpath(__file__)))),
-                       'python', 'qemu')
+QEMU_DIR = dirname(dirname(dirname(normpath(__file__))))
+QEMU_PYPATH = joinpath(QEMU_DIR, 'python', 'qemu')
 sys.path.append(QEMU_PYPATH)
 print(__file__, sys.path[-1])
 
@@ -128,6 +139,9 @@ class LogMessageClassifier:
        :param qemux: the QEMU executable name, to filter out useless messages
     """
 
+    CACHE_SIZE = 4096
+    """Count of classified lines to remember."""
+
     def __init__(self, classifiers: Optional[dict[str, list[str]]] = None,
                  qemux: Optional[str] = None):
         self._qemux = qemux
@@ -155,6 +169,9 @@ def __init__(self, classifiers: Optional[dict[str, list[str]]] = None,
                 lvl = getattr(logging, 'NOTSET')
                 # never match RE
                 self._regexes[lvl] = re.compile(r'\A(?!x)x')
+        # identical messages are often emitted many times, do not run all the
+        # regular expressions again on them
+        self._classify = lru_cache(maxsize=self.CACHE_SIZE)(self._classify)
 
     def classify(self, line: str, default: int = logging.ERROR) -> int:
         """Classify log level of a line depending on its content.
@@ -163,6 +180,9 @@ def classify(self, line: str, default: int = logging.ERROR) -> int:
            :param default: defaut log level in no classification is found
            :return: the logger log level to use
         """
+        return self._classify(line, default)
+
+    def _classify(self, line: str, default: int) -> int:
         if self._qemux and line.startswith(self._qemux):
             # discard QEMU internal messages that cannot be disable from the VM
             if line.find("QEMU waiting") > 0:
@@ -261,6 +281,7 @@ def trig_match(bline):
         last_error = ''
         vcp_map = tdef.vcp_map
         vcp_ctxs: dict[int, tuple[str, socket, bytearray]] = {}
+        qemu_bufs: dict[int, tuple[bool, bytearray]] = {}
         try:
             workdir = dirname(tdef.command[0])
             log.debug('Executing QEMU as %s', ' '.join(tdef.command))
@@ -277,19 +298,21 @@ def trig_match(bline):
                 log.error('QEMU bailed out: %d for "%s"', ret, tdef.test_name)
                 raise OSError()
             log.debug('Execute QEMU for %.0f secs', tdef.timeout)
-            # unfortunately, subprocess's stdout calls are blocking, so the
-            # only way to get near real-time output from QEMU is to use a
-            # dedicated thread that may block whenever no output is available
-            # from the VM. This thread reads and pushes back lines to a local
-            # queue, which is popped and logged to the local logger on each
-            # loop. Note that Popen's communicate() also relies on threads to
-            # perform stdout/stderr read out.
-            log_q = deque()
-            Thread(target=self._qemu_logger, name='qemu_out_logger',
-                   args=(proc, log_q, True), daemon=True).start()
-            Thread(target=self._qemu_logger, name='qemu_err_logger',
-                   args=(proc, log_q, False), daemon=True).start()
+            # subprocess's stdout calls are blocking, so QEMU outputs are
+            # polled along with the VCP sockets, and raw data are read and
+            # split into lines as soon as they are available, so that no
+            # reader thread is required.
             poller = spoll()
+            # QEMU outputs should be drained as long as QEMU runs, including
+            # while VCPs are not yet handled
+            qpoller = spoll()
+            for err, stream in enumerate((proc.stdout, proc.stderr)):
+                qemu_bufs[stream.fileno()] = (bool(err), bytearray())
+                poller.register(stream, POLLIN | POLLERR | POLLHUP)
+                qpoller.register(stream, POLLIN | POLLERR | POLLHUP)
+            qemu_exec = f'{basename(tdef.command[0])}: '
+            classifier = LogMessageClassifier(classifiers=self._log_classifiers,
+                                              qemux=qemu_exec)
             connect_map = vcp_map.copy()
             timeout = now() + tdef.start_delay
             # ensure that QEMU starts and give some time for it to set up
@@ -328,11 +351,20 @@ def trig_match(bline):
                 # removal from dictionary cannot be done while iterating it
                 for vcpid in connected:
                     del connect_map[vcpid]
+                self._drain_qemu_streams(qpoller, qemu_bufs, classifier)
             self._colorize_vcp_log(vcplogname, vcp_lognames)
             xstart = now()
             if tdef.context:
                 try:
-                    tdef.context.execute('with', sync=sync_event)
+                    # synchronous commands may wait for QEMU, which may in
+                    # turn wait for its outputs to be consumed
+                    with ThreadPoolExecutor(max_workers=1) as executor:
+                        future = executor.submit(tdef.context.execute, 'with',
+                                                 sync=sync_event)
+                        while not future.done():
+                            self._drain_qemu_streams(qpoller, qemu_bufs,
+                                                     classifier)
+                        future.result()
                 except OSError as exc:
                     ret = exc.errno
                     last_error = exc.strerror
@@ -342,23 +374,9 @@ def trig_match(bline):
                     ret = 126
                     last_error = str(exc)
                     raise
-            qemu_exec = f'{basename(tdef.command[0])}: '
-            classifier = LogMessageClassifier(classifiers=self._log_classifiers,
-                                              qemux=qemu_exec)
             abstimeout = float(tdef.timeout) + now()
-            qemu_default_log = logging.ERROR
             vcp_default_log = logging.DEBUG
             while now() < abstimeout:
-                while log_q:
-                    err, qline = log_q.popleft()
-                    if err:
-                        level = classifier.classify(qline, qemu_default_log)
-                        if level == logging.INFO and \
-                           qline.find('QEMU waiting for connection') >= 0:
-                            level = logging.DEBUG
-                    else:
-                        level = logging.INFO
-                    self._qlog.log(level, qline)
                 if tdef.context:
                     wret = tdef.context.check_error()
                     if wret:
@@ -380,6 +398,11 @@ def trig_match(bline):
                               ret, tdef.test_name)
                     break
                 for vfd, event in poller.poll(0.01):
+                    if vfd in qemu_bufs:
+                        if not self._read_qemu_stream(vfd, event, qemu_bufs,
+                                                      classifier):
+                            poller.unregister(vfd)
+                        continue
                     if event in (POLLERR, POLLHUP):
                         poller.modify(vfd, 0)
                         continue
@@ -457,14 +480,21 @@ def trig_match(bline):
                     proc.kill()
                 if ret is None:
                     ret = proc.returncode
-                # retrieve the remaining log messages
-                stdlog = self._qlog.info if ret else self._qlog.debug
-                for msg, logger in zip(proc.communicate(timeout=0.1),
-                                       (stdlog, self._qlog.error)):
-                    for line in msg.split('\n'):
+                # retrieve the remaining log messages, including any
+                # incomplete line that has already been read out
+                pendings = [qbuf.decode('utf-8', errors='ignore')
+                            for _, qbuf in qemu_bufs.values()] or ['', '']
+                stdlevel = logging.INFO if ret else logging.DEBUG
+                for pending, msg, level in zip(
+                        pendings, proc.communicate(timeout=0.1),
+                        (stdlevel, logging.ERROR)):
+                    if not self._qlog.isEnabledFor(level):
+                        # do not split messages that would be discarded
+                        continue
+                    for line in f'{pending}{msg}'.split('\n'):
                         line = line.strip()
                         if line:
-                            logger(line)
+                            self._qlog.log(level, line)
         xtime = ExecTime(xend-xstart) if xstart and xend else 0.0
         return abs(ret) or 0, xtime, last_error
 
@@ -508,13 +538,46 @@ def _colorize_vcp_log(self, vcplogname: str, lognames: list[str]) -> None:
         for color, logname in enumerate(sorted(lognames)):
             clr_fmt.add_logger_colors(f'{vcplogname}.{logname}', color)
 
-    def _qemu_logger(self, proc: Popen, queue: deque, err: bool):
-        # worker thread, blocking on VM stdout/stderr
-        stream = proc.stderr if err else proc.stdout
-        while proc.poll() is None:
-            line = stream.readline().strip()
-            if line:
-                queue.append((err, line))
+    def _drain_qemu_streams(self, qpoller: Any,
+                            qemu_bufs: dict[int, tuple[bool, bytearray]],
+                            classifier: LogMessageClassifier) -> None:
+        # wait up to 10 ms for QEMU outputs; on end of stream, the stream is
+        # also reported, and unregistered, from the main poller later on
+        for vfd, event in qpoller.poll(10):
+            if not self._read_qemu_stream(vfd, event, qemu_bufs, classifier):
+                qpoller.unregister(vfd)
+
+    def _read_qemu_stream(self, vfd: int, event: int,
+                          qemu_bufs: dict[int, tuple[bool, bytearray]],
+                          classifier: LogMessageClassifier) -> bool:
+        err, qbuf = qemu_bufs[vfd]
+        data = read(vfd, 4096) if event & POLLIN else b''
+        if data:
+            qbuf += data
+            lines = qbuf.split(b'\n')
+            qbuf[:] = lines[-1]
+            lines.pop()
+        else:
+            # end of stream, flush any incomplete line
+            lines = [bytes(qbuf)]
+            qbuf.clear()
+        self._log_qemu_lines(classifier, err, lines)
+        return bool(data)
+
+    def _log_qemu_lines(self, classifier: LogMessageClassifier, err: bool,
+                        lines: list[bytes]) -> None:
+        for bline in lines:
+            qline = bline.decode('utf-8', errors='ignore').strip()
+            if not qline:
+                continue
+            if err:
+                level = classifier.classify(qline, logging.ERROR)
+                if level == logging.INFO and \
+                   qline.find('QEMU waiting for connection') >= 0:
+                    level = logging.DEBUG
+            else:
+                level = logging.INFO
+            self._qlog.log(level, qline)
 
     def _get_exit_code(self, xmo: re.Match) -> int:
         groups = xmo.groups()
@@ -551,6 +614,9 @@ class QEMUFileManager:
 
     DEFAULT_OTP_ECC_BITS = 6
 
+    PLACEHOLDER_CRE = re.compile(r'\$\{(\w+)\}')
+    """Variable placeholder."""
+
     def __init__(self, keep_temp: bool = False):
         self._log = getLogger('pyot.file')
         self._keep_temp = keep_temp
@@ -599,16 +665,21 @@ def interpolate(self, value: Any) -> str:
            :param value: input value
            :return: interpolated value as a string
         """
-        def replace(smo: re.Match) -> str:
-            name = smo.group(1)
+        svalue = str(value)
+        parts = self._split_placeholders(svalue)
+        if len(parts) == 1:
+            # no placeholder
+            return svalue
+        nparts = list(parts)
+        # placeholder names are stored at odd positions
+        for pos in range(1, len(parts), 2):
+            name = parts[pos]
             val = self._env[name] if name in self._env \
                 else environ.get(name, '')
             if not val:
-                getLogger('pyot.file').warning("Unknown placeholder '%s'",
-                                               name)
-            return val
-        svalue = str(value)
-        nvalue = re.sub(r'\$\{(\w+)\}', replace, svalue)
+                self._log.warning("Unknown placeholder '%s'", name)
+            nparts[pos] = val
+        nvalue = ''.join(nparts)
         if nvalue != svalue:
             self._log.debug('Interpolate %s with %s', value, nvalue)
         return nvalue
@@ -791,6 +862,13 @@ def delete_otp_image(self, filename: str) -> None:
                 self._otp_files[vmem] = (raw, count)
             break
 
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _split_placeholders(value: str) -> tuple[str, ...]:
+        # the same strings are interpolated for each test, whereas variable
+        # values may change from one test to another: only cache the parsing
+        return tuple(QEMUFileManager.PLACEHOLDER_CRE.split(value))
+
     def _configure_logger(self, tool) -> None:
         log = getLogger('pyot')
         flog = tool.logger
@@ -848,13 +926,15 @@ class QEMUContextWorker:
     """Background task for QEMU context.
     """
 
+    SHELL_CHARS = frozenset('\n\\\'"`$&|;<>()*?[]{}~#')
+    """Characters that require a shell to interpret a command."""
+
     def __init__(self, cmd: str, env: dict[str, str],
                  sync: Optional[Event] = None):
         self._log = getLogger('pyot.cmd')
         self._cmd = cmd
         self._env = env
         self._sync = sync
-        self._log_q = deque()
         self._resume = False
         self._thread: Optional[Thread] = None
         self._ret = None
@@ -893,6 +973,46 @@ def first_error(self):
         """Return the message of the first error, if any."""
         return self._first_error
 
+    @classmethod
+    def split_command(cls, cmd: str) -> tuple[Any, bool]:
+        """Tell how a command should be spawned.
+
+           A shell is only used when the command relies on some shell syntax,
+           otherwise the command may be directly executed.
+
+           :param cmd: the command line
+           :return: a 2-uple of the command to spawn, either a string or an
+                    argument list, and whether a shell is required
+        """
+        if cls.SHELL_CHARS.intersection(cmd):
+            return cmd, True
+        args = shsplit(cmd)
+        if not args or '=' in args[0]:
+            # empty command or environment variable assignment
+            return cmd, True
+        return args, False
+
+    @classmethod
+    def spawn(cls, cmd: str, env: dict[str, str]) -> Popen:
+        """Start a command whose outputs are piped as text.
+
+           :param cmd: the command line
+           :param env: the environment of the command
+           :return: the started process
+        """
+        args, shell = cls.split_command(cmd)
+        while True:
+            try:
+                # pylint: disable=consider-using-with
+                return Popen(args, bufsize=1, stdout=PIPE, stderr=PIPE,
+                             shell=shell, env=env, encoding='utf-8',
+                             errors='ignore', text=True)
+            except OSError:
+                if shell:
+                    raise
+                # may be a shell builtin, let the shell report any error
+                args, shell = cmd, True
+
     def _run(self):
         self._resume = True
         if self._sync and not self._sync.is_set():
@@ -902,28 +1022,38 @@ def _run(self):
                     self._log.debug('Synchronized')
                     break
             self._sync.clear()
-        # pylint: disable=consider-using-with
-        proc = Popen(self._cmd,  bufsize=1, stdout=PIPE, stderr=PIPE,
-                     shell=True, env=self._env, encoding='utf-8',
-                     errors='ignore', text=True)
-        Thread(target=self._logger, args=(proc, True), daemon=True).start()
-        Thread(target=self._logger, args=(proc, False), daemon=True).start()
+        proc = self.spawn(self._cmd, self._env)
+        # both output streams are monitored from this thread: raw pipe data
+        # is read as soon as it is available, and split into lines here, so
+        # that no reader thread is required.
+        selector = DefaultSelector()
+        selector.register(proc.stdout, EVENT_READ, (False, bytearray()))
+        selector.register(proc.stderr, EVENT_READ, (True, bytearray()))
         qemu_exec = f'{basename(self._cmd[0])}: '
         classifier = LogMessageClassifier(qemux=qemu_exec)
         while self._resume:
-            while self._log_q:
-                err, qline = self._log_q.popleft()
-                if err:
-                    if not self._first_error:
-                        self._first_error = qline
-                    loglevel = classifier.classify(qline)
-                    self._log.log(loglevel, qline)
-                else:
-                    self._log.debug(qline)
+            for key, _ in selector.select(0.1):
+                err, buf = key.data
+                data = read(key.fd, 4096)
+                if not data:
+                    # end of stream, flush any incomplete line
+                    self._log_line(classifier, err, buf)
+                    selector.unregister(key.fileobj)
+                    continue
+                buf += data
+                lines = buf.split(b'\n')
+                buf[:] = lines[-1]
+                for line in lines[:-1]:
+                    self._log_line(classifier, err, line)
             if proc.poll() is not None:
                 # worker has exited on its own
                 self._resume = False
                 break
+        # flush any incomplete line
+        for key in selector.get_map().values():
+            err, buf = key.data
+            self._log_line(classifier, err, buf)
+        selector.close()
         try:
             # give some time for the process to complete on its own
             proc.wait(0.2)
@@ -942,28 +1072,36 @@ def _run(self):
                 proc.kill()
                 self._ret = proc.returncode
         # retrieve the remaining log messages
-        stdlog = self._log.info if self._ret else self._log.debug
+        stdlevel = logging.INFO if self._ret else logging.DEBUG
         try:
             outs, errs = proc.communicate(timeout=0.1)
             if not self._first_error:
                 self._first_error = errs.split('\n', 1)[0]
-            for sfp, logger in zip((outs, errs), (stdlog, self._log.error)):
+            for sfp, level in zip((outs, errs), (stdlevel, logging.ERROR)):
+                if not self._log.isEnabledFor(level):
+                    # do not split messages that would be discarded
+                    continue
                 for line in sfp.split('\n'):
                     line = line.strip()
                     if line:
-                        logger(line)
+                        self._log.log(level, line)
         except TimeoutExpired:
             proc.kill()
             if self._ret is None:
                 self._ret = proc.returncode
 
-    def _logger(self, proc: Popen, err: bool):
-        # worker thread, blocking on VM stdout/stderr
-        stream = proc.stderr if err else proc.stdout
-        while proc.poll() is None:
-            line = stream.readline().strip()
-            if line:
-                self._log_q.append((err, line))
+    def _log_line(self, classifier: LogMessageClassifier, err: bool,
+                  bline: bytes) -> None:
+        qline = bline.decode('utf-8', errors='ignore').strip()
+        if not qline:
+            return
+        if err:
+            if not self._first_error:
+                self._first_error = qline
+            loglevel = classifier.classify(qline)
+            self._log.log(loglevel, qline)
+        else:
+            self._log.debug(qline)
 
 
 class QEMUContext:
@@ -975,11 +1113,15 @@ class QEMUContext:
        :param qfm: the file manager
        :param qemu_cmd: the command and argument to execute QEMU
        :param context: the contex configuration for the current test
+       :param env: optional test-specific environment variables
+       :param base_env: optional environment shared by all tests, see
+                        build_base_env. It is never modified.
     """
 
     def __init__(self, test_name: str, qfm: QEMUFileManager,
                  qemu_cmd: list[str], context: dict[str, list[str]],
-                 env: Optional[dict[str, str]] = None):
+                 env: Optional[dict[str, str]] = None,
+                 base_env: Optional[dict[str, str]] = None):
         # pylint: disable=too-many-arguments
         self._clog = getLogger('pyot.ctx')
         self._test_name = test_name
@@ -987,6 +1129,8 @@ def __init__(self, test_name: str, qfm: QEMUFileManager,
         self._qemu_cmd = qemu_cmd
         self._context = context
         self._env = env or {}
+        self._base_env = base_env
+        self._exec_env: Optional[dict[str, str]] = None
         self._workers: list[Popen] = []
         self._first_error: str = ''
 
@@ -1010,11 +1154,8 @@ def execute(self, ctx_name: str, code: int = 0,
             self._clog.info("Discard execution of '%s' commands after failure "
                             "of '%s'", ctx_name, self._test_name)
             return
-        env = dict(environ)
-        env.update(self._env)
-        if self._qemu_cmd:
-            env['PATH'] = ':'.join((env['PATH'], dirname(self._qemu_cmd[0])))
         if ctx:
+            env = self._get_exec_env()
             for cmd in ctx:
                 bkgnd = ctx_name == 'with'
                 if cmd.endswith('!'):
@@ -1029,49 +1170,28 @@ def execute(self, ctx_name: str, code: int = 0,
                         raise ValueError(f"Cannot execute background command "
                                          f"in [{ctx_name}] context for "
                                          f"'{self._test_name}'")
-                    rcmd = relpath(cmd)
-                    if rcmd.startswith(pardir):
-                        rcmd = cmd
-                    rcmd = ' '.join(p if not p.startswith(sep) else basename(p)
-                                    for p in rcmd.split(' '))
-                    self._clog.info('Execute "%s" in background for [%s] '
-                                    'context', rcmd, ctx_name)
+                    if self._clog.isEnabledFor(logging.INFO):
+                        self._clog.info('Execute "%s" in background for [%s] '
+                                        'context', self._get_short_cmd(cmd),
+                                        ctx_name)
                     worker = QEMUContextWorker(cmd, env, sync)
                     worker.run()
                     self._workers.append(worker)
                 else:
                     if sync:
                         self._clog.debug('Synchronization ignored')
-                    cmd = normpath(cmd.rstrip())
-                    rcmd = relpath(cmd)
-                    if rcmd.startswith(pardir):
-                        rcmd = cmd
-                    rcmd = ' '.join(p if not p.startswith(sep) else basename(p)
-                                    for p in rcmd.split(' '))
-                    self._clog.info('Execute "%s" in sync for [%s] context',
-                                    rcmd, ctx_name)
-                    # pylint: disable=consider-using-with
-                    proc = Popen(cmd, bufsize=1, stdout=PIPE, stderr=PIPE,
-                                 shell=True, env=env, encoding='utf-8',
-                                 errors='ignore', text=True)
-                    ret = 0
-                    try:
-                        outs, errs = proc.communicate(timeout=5)
-                        ret = proc.returncode
-                    except TimeoutExpired:
-                        proc.kill()
-                        outs, errs = proc.communicate()
-                        ret = proc.returncode
-                    if not self._first_error:
-                        self._first_error = errs.split('\n', 1)[0]
-                    for sfp, logger in zip(
-                            (outs, errs),
-                            (self._clog.debug,
-                             self._clog.error if ret else self._clog.info)):
-                        for line in sfp.split('\n'):
-                            line = line.strip()
-                            if line:
-                                logger(line)
+                    if self._clog.isEnabledFor(logging.INFO):
+                        self._clog.info('Execute "%s" in sync for [%s] '
+                                        'context', self._get_short_cmd(cmd),
+                                        ctx_name)
+                    proc = QEMUContextWorker.spawn(cmd, env)
+                    errs = self._communicate(proc, 5)
+                    ret = proc.returncode
+                    if not self._first_error and errs:
+                        self._first_error = errs[0]
+                    logger = self._clog.error if ret else self._clog.info
+                    for line in errs:
+                        logger(line)
                     if ret:
                         self._clog.error("Fail to execute '%s' command for "
                                          "'%s'", cmd, self._test_name)
@@ -1120,6 +1240,82 @@ def finalize(self) -> int:
                     self._first_error = worker.first_error
         return max(rets)
 
+    @classmethod
+    def build_base_env(cls, qemu_cmd: list[str]) -> dict[str, str]:
+        """Build the execution environment of context commands, without any
+           test-specific variable.
+
+           :param qemu_cmd: the command and argument to execute QEMU
+           :return: the environment
+        """
+        env = dict(environ)
+        if qemu_cmd:
+            env['PATH'] = ':'.join((env['PATH'], dirname(qemu_cmd[0])))
+        return env
+
+    def _get_exec_env(self) -> dict[str, str]:
+        # the environment is shared by all the commands of all the contexts
+        if self._exec_env is None:
+            env = self._base_env
+            if env is None:
+                env = self.build_base_env(self._qemu_cmd)
+            if self._env:
+                env = dict(env)
+                env.update(self._env)
+            self._exec_env = env
+        return self._exec_env
+
+    @staticmethod
+    def _get_short_cmd(cmd: str) -> str:
+        # shorten the command line for display purpose only
+        rcmd = relpath(cmd)
+        if rcmd.startswith(pardir):
+            rcmd = cmd
+        return ' '.join(p if not p.startswith(sep) else basename(p)
+                        for p in rcmd.split(' '))
+
+    def _communicate(self, proc: Popen, timeout: float) -> list[str]:
+        # standard output is logged as soon as it is received, as some
+        # commands are verbose; error lines are returned as their log level
+        # depends on the command completion status.
+        errs: list[str] = []
+        selector = DefaultSelector()
+        selector.register(proc.stdout, EVENT_READ, (False, bytearray()))
+        selector.register(proc.stderr, EVENT_READ, (True, bytearray()))
+        abstimeout = now() + timeout
+        while selector.get_map():
+            if abstimeout is not None:
+                remaining = abstimeout - now()
+                if remaining <= 0:
+                    proc.kill()
+                    abstimeout = None
+                    continue
+            else:
+                remaining = None
+            for key, _ in selector.select(remaining):
+                err, buf = key.data
+                data = read(key.fd, 4096)
+                if data:
+                    buf += data
+                    lines = buf.split(b'\n')
+                    buf[:] = lines[-1]
+                    lines.pop()
+                else:
+                    # end of stream, flush any incomplete line
+                    lines = [buf]
+                    selector.unregister(key.fileobj)
+                for line in lines:
+                    line = line.decode('utf-8', errors='ignore').strip()
+                    if not line:
+                        continue
+                    if err:
+                        errs.append(line)
+                    else:
+                        self._clog.debug(line)
+        selector.close()
+        proc.wait()
+        return errs
+
 
 class QEMUExecuter:
     """Test execution sequencer.
@@ -1144,6 +1340,9 @@ class QEMUExecuter:
         QEMUWrapper.NO_MATCH_RETURN_CODE: 'UNKNOWN',
     }
 
+    RESULT_MAP_INV = {v: k for k, v in RESULT_MAP.items()}
+    """Result codes, indexed by their names."""
+
     DEFAULT_START_DELAY = 1.0
     """Default start up delay to let QEMU initialize before connecting the
        virtual UART port.
@@ -1152,6 +1351,18 @@ class QEMUExecuter:
     DEFAULT_SERIAL_PORT = 'serial0'
     """Default VCP name."""
 
+    RESULT_FLUSH_ROWS = 16
+    """Maximum count of test results to buffer before flushing them."""
+
+    RESULT_FLUSH_PERIOD = 1.0
+    """Maximum delay in seconds before flushing buffered test results."""
+
+    SEARCH_WORKERS = 8
+    """Maximum count of concurrent test searches."""
+
+    FALSE_VALUES = frozenset(('', '0', 'false'))
+    """Environment variable values that disable a configuration condition."""
+
     LOG_SHORTCUTS = {
         'A': 'in_asm',
         'E': 'exec',
@@ -1161,6 +1372,12 @@ class QEMUExecuter:
     }
     """Shortcut names for QEMU log sources."""
 
+    EOL_CRE = re.compile(r'[\n\r]')
+    """End of line characters."""
+
+    SPACES_CRE = re.compile(r'\s{2,}')
+    """Sequences of space characters."""
+
     def __init__(self, qfm: QEMUFileManager, config: dict[str, any],
                  args: Namespace):
         self._log = getLogger('pyot.exec')
@@ -1169,7 +1386,11 @@ def __init__(self, qfm: QEMUFileManager, config: dict[str, any],
         self._args = args
         self._argdict: dict[str, Any] = {}
         self._qemu_cmd: list[str] = []
+        self._base_env: Optional[dict[str, str]] = None
         self._suffixes = []
+        self._radixes: dict[str, str] = {}
+        self._env_conds: dict[str, bool] = {}
+        self._rom_paths: frozenset[str] = frozenset()
         if hasattr(self._args, 'opts'):
             setattr(self._args, 'global_opts', getattr(self._args, 'opts'))
             setattr(self._args, 'opts', [])
@@ -1183,8 +1404,11 @@ def build(self) -> None:
         """
         exec_info = self._build_qemu_command(self._args)
         self._qemu_cmd = exec_info.command
-        self._argdict = dict(self._args.__dict__)
+        self._base_env = None
+        self._load_argdict()
         self._suffixes = []
+        self._radixes.clear()
+        self._env_conds.clear()
         suffixes = self._config.get('suffixes', [])
         if not isinstance(suffixes, list):
             raise ValueError('Invalid suffixes sub-section')
@@ -1193,7 +1417,7 @@ def build(self) -> None:
     def enumerate_tests(self) -> Iterator[str]:
         """Enumerate tests to execute.
         """
-        self._argdict = dict(self._args.__dict__)
+        self._load_argdict()
         for tst in sorted(self._build_test_list()):
             ttype = self.guess_test_type(tst)
             yield f'{basename(tst)} ({ttype})'
@@ -1212,6 +1436,8 @@ def run(self, debug: bool, allow_no_test: bool) -> int:
         cfp = open(result_file, 'wt', encoding='utf-8') if result_file else None
         try:
             csv = csv_writer(cfp) if cfp else None
+            flush_rows = 0
+            flush_time = now()
             if csv:
                 csv.writerow((x.title() for x in TestResult._fields))
             app = self._argdict.get('exec')
@@ -1252,6 +1478,12 @@ def run(self, debug: bool, allow_no_test: bool) -> int:
                     exec_info = self._build_qemu_test_command(test)
                     exec_info.test_name = test_name
                     exec_info.context.execute('pre')
+                    if flush_rows:
+                        # do not leave results pending while the next test,
+                        # which may last long, is executed
+                        cfp.flush()
+                        flush_rows = 0
+                        flush_time = now()
                     tret, xtime, err = qot.run(exec_info)
                     cret = exec_info.context.finalize()
                     if exec_info.expect_result != 0:
@@ -1288,8 +1520,14 @@ def run(self, debug: bool, allow_no_test: bool) -> int:
                     csv.writerow(TestResult(test_name, sret, xtime, icount,
                                             err))
                     # want to commit result as soon as possible if some client
-                    # is live-tracking progress on long test runs
-                    cfp.flush()
+                    # is live-tracking progress on long test runs, but do not
+                    # flush on each row for fast test runs
+                    flush_rows += 1
+                    if flush_rows >= self.RESULT_FLUSH_ROWS or \
+                            now() > flush_time + self.RESULT_FLUSH_PERIOD:
+                        cfp.flush()
+                        flush_rows = 0
+                        flush_time = now()
                 else:
                     self._log.info('"%s" executed in %s (%s)',
                                    test_name, xtime, sret)
@@ -1317,11 +1555,17 @@ def get_test_radix(self, filename: str) -> str:
            :param filename: the path to the test executable
            :return: the test name
         """
+        try:
+            return self._radixes[filename]
+        except KeyError:
+            pass
         test_name = basename(filename).split('.')[0]
         for suffix in self._suffixes:
             if not test_name.endswith(suffix):
                 continue
-            return test_name[:-len(suffix)]
+            test_name = test_name[:-len(suffix)]
+            break
+        self._radixes[filename] = test_name
         return test_name
 
     @classmethod
@@ -1338,7 +1582,7 @@ def get_namespace_arg(cls, args: Namespace, name: str) -> Optional[str]:
     def flatten(lst: list) -> list:
         """Flatten a list.
         """
-        return [item for sublist in lst for item in sublist]
+        return list(chain.from_iterable(lst))
 
     @staticmethod
     def abspath(path: str) -> str:
@@ -1353,8 +1597,19 @@ def guess_test_type(filepath: str) -> str:
 
            :return: identified content
         """
-        with open(filepath, 'rb') as bfp:
-            header = bfp.read(4)
+        # a test file is probed several times, i.e. when listed and executed
+        return QEMUExecuter._guess_file_type(filepath,
+                                             stat(filepath).st_mtime_ns)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _guess_file_type(filepath: str, _: int) -> str:
+        # the modification time is only used as part of the cache key
+        fd = os_open(filepath, O_RDONLY)
+        try:
+            header = read(fd, 4)
+        finally:
+            close(fd)
         if header == b'\x7fELF':
             return 'elf'
         if header == b'OTPT':
@@ -1387,25 +1642,27 @@ def _build_qemu_fw_args(self, args: Namespace) \
                                     if x)
             except ValueError:
                 self._log.warning('Unknown variant syntax %s', variant)
-        for chip_id in range(chiplet_count):
-            rom_count = 0
-            for rom in roms:
-                rom_path = self._qfm.interpolate(rom)
-                if not isfile(rom_path):
-                    raise ValueError(f'Unable to find ROM file {rom_path}')
-                rom_ids = []
-                if args.first_soc:
-                    if chiplet_count == 1:
-                        rom_ids.append(f'{args.first_soc}.')
-                    else:
-                        rom_ids.append(f'{args.first_soc}{chip_id}.')
-                rom_ids.append('rom')
-                if multi_rom:
-                    rom_ids.append(f'{rom_count}')
-                rom_id = ''.join(rom_ids)
-                rom_opt = f'ot-rom_img,id={rom_id},file={rom_path}'
-                fw_args.extend(('-object', rom_opt))
-                rom_count += 1
+        # ROM files are the same for all chiplets
+        rom_paths = []
+        for rom in roms:
+            rom_path = self._qfm.interpolate(rom)
+            if not isfile(rom_path):
+                raise ValueError(f'Unable to find ROM file {rom_path}')
+            rom_paths.append(rom_path)
+        if not args.first_soc:
+            soc_ids = [''] * chiplet_count
+        elif chiplet_count == 1:
+            soc_ids = [f'{args.first_soc}.']
+        else:
+            soc_ids = [f'{args.first_soc}{chip_id}.'
+                       for chip_id in range(chiplet_count)]
+        rom_count = len(rom_paths)
+        rom_idxs = [str(ix) if multi_rom else '' for ix in range(rom_count)]
+        rom_opts = [f'ot-rom_img,id={soc_id}rom{rom_idx},file={rom_path}'
+                    for soc_id in soc_ids
+                    for rom_idx, rom_path in zip(rom_idxs, rom_paths)]
+        fw_args.extend(chain.from_iterable(('-object', rom_opt)
+                                           for rom_opt in rom_opts))
         xtype = None
         if args.exec:
             exec_path = self.abspath(args.exec)
@@ -1469,15 +1726,15 @@ def _build_qemu_vcp_args(self, args: Namespace) -> \
             raise ValueError(f'TCP port not specified: {device}') from exc
         except TypeError as exc:
             raise ValueError(f'Invalid TCP serial device: {device}') from exc
-        mux = f'mux={"on" if args.muxserial else "off"}'
+        # options shared by all VCP character devices
+        sock_opts = f'mux={"on" if args.muxserial else "off"},server=on,wait=on'
         vcps = args.vcp or [self.DEFAULT_SERIAL_PORT]
         vcp_args = ['-display', 'none']
         vcp_map = {}
         for vix, vcp in enumerate(vcps):
             vcp_map[vcp] = (host, port+vix)
-            vcp_args.extend(('-chardev',
-                             f'socket,id={vcp},host={host},port={port+vix},'
-                             f'{mux},server=on,wait=on'))
+            vcp_args.extend(('-chardev', f'socket,id={vcp},host={host},'
+                                         f'port={port+vix},{sock_opts}'))
             if vcp == self.DEFAULT_SERIAL_PORT:
                 vcp_args.extend(('-serial', 'chardev:serial0'))
         return vcp_args, vcp_map
@@ -1587,45 +1844,75 @@ def _build_test_list(self, alphasort: bool = True) -> list[str]:
             tfilters = ['*'] + pfilters
         else:
             tfilters = list(pfilters)
+        # all test filters are matched at once
+        tfilter_re = re.compile('|'.join(f'(?:{translate(f)})'
+                                         for f in tfilters))
         inc_filters = self._build_config_list('include')
         if inc_filters:
             self._log.debug('Searching for tests from %s dir', testdir)
-            for path_filter in filter(None, inc_filters):
-                if testdir:
-                    path_filter = joinpath(testdir, path_filter)
-                paths = set(glob(path_filter, recursive=True))
-                for path in paths:
-                    if isfile(path):
-                        for tfilter in tfilters:
-                            if fnmatchcase(self.get_test_radix(path), tfilter):
-                                pathnames.add(path)
-                                break
+            # a pattern is only searched once, even if listed several times
+            path_filters = [joinpath(testdir, f) if testdir else f
+                            for f in dict.fromkeys(filter(None, inc_filters))]
+            for path in self._find_files(path_filters):
+                if path in pathnames:
+                    continue
+                if tfilter_re.match(self.get_test_radix(path)):
+                    pathnames.add(path)
         for testfile in self._enumerate_from('include_from'):
             if not isfile(testfile):
                 raise ValueError(f'Unable to locate test file '
                                  f'"{testfile}"')
-            for tfilter in tfilters:
-                if fnmatchcase(self.get_test_radix(testfile),
-                               tfilter):
-                    pathnames.add(testfile)
+            if tfilter_re.match(self.get_test_radix(testfile)):
+                pathnames.add(testfile)
         if not pathnames:
             return []
-        roms = self._argdict.get('rom')
-        pathnames -= {normpath(rom) for rom in roms}
+        pathnames -= self._rom_paths
         xtfilters = [f[1:].strip() for f in cfilters if f.startswith('!')]
         exc_filters = self._build_config_list('exclude')
         xtfilters.extend(exc_filters)
         if xtfilters:
-            for path_filter in filter(None, xtfilters):
-                if testdir:
-                    path_filter = joinpath(testdir, path_filter)
-                paths = set(glob(path_filter, recursive=True))
-                pathnames -= paths
-        pathnames -= set(self._enumerate_from('exclude_from'))
+            path_filters = [joinpath(testdir, f) if testdir else f
+                            for f in dict.fromkeys(filter(None, xtfilters))]
+            if glob_translate:
+                # all exclusion patterns are matched at once, without searching
+                # the filesystem
+                xfilter_re = re.compile('|'.join(
+                    f'(?:{glob_translate(f, recursive=True)})'
+                    for f in path_filters))
+                pathnames = {p for p in pathnames if not xfilter_re.match(p)}
+            else:
+                for path_filter in path_filters:
+                    if not pathnames:
+                        # no need to search the filesystem any further
+                        break
+                    pathnames.difference_update(iglob(path_filter,
+                                                      recursive=True))
+        pathnames.difference_update(self._enumerate_from('exclude_from'))
         if alphasort:
             return sorted(pathnames, key=basename)
         return list(pathnames)
 
+    def _find_files(self, path_filters: list[str]) -> Iterator[str]:
+        if len(path_filters) < 2:
+            # a single directory walk gains nothing from a worker thread,
+            # files are filtered as they are found
+            for path_filter in path_filters:
+                yield from self._search_files(path_filter)
+            return
+        # directory walks mostly wait on the filesystem, run them
+        # concurrently, each worker collecting all the files of its pattern
+        with ThreadPoolExecutor(max_workers=min(self.SEARCH_WORKERS,
+                                                len(path_filters))) \
+                as executor:
+            for paths in executor.map(list, map(self._search_files,
+                                                path_filters)):
+                yield from paths
+
+    @staticmethod
+    def _search_files(path_filter: str) -> Iterator[str]:
+        return (path for path in iglob(path_filter, recursive=True)
+                if isfile(path))
+
     def _enumerate_from(self, config_entry: str) -> Iterator[str]:
         incf_filters = self._build_config_list(config_entry)
         if incf_filters:
@@ -1637,13 +1924,12 @@ def _enumerate_from(self, config_entry: str) -> Iterator[str]:
                 incf_dir = dirname(incf)
                 with open(incf, 'rt', encoding='utf-8') as ifp:
                     for testfile in ifp:
-                        testfile = re.sub('#.*$', '', testfile).strip()
+                        testfile = testfile.partition('#')[0].strip()
                         if not testfile:
                             continue
                         testfile = self._qfm.interpolate(testfile)
-                        if not testfile.startswith(sep):
-                            testfile = joinpath(incf_dir, testfile)
-                        yield normpath(testfile)
+                        # absolute test paths discard the include directory
+                        yield normpath(joinpath(incf_dir, testfile))
 
     def _build_config_list(self, config_entry: str) -> list:
         cfglist = []
@@ -1659,11 +1945,7 @@ def _build_config_list(self, config_entry: str) -> list:
                 continue
             if isinstance(item, dict):
                 for dname, dval in item.items():
-                    try:
-                        cond = bool(int(environ.get(dname, '0')))
-                    except (ValueError, TypeError):
-                        cond = False
-                    if not cond:
+                    if not self._get_env_condition(dname):
                         continue
                     if isinstance(dval, str):
                         dval = [dval]
@@ -1673,17 +1955,32 @@ def _build_config_list(self, config_entry: str) -> list:
                                 cfglist.append(sitem)
         return cfglist
 
+    def _load_argdict(self) -> None:
+        self._argdict = dict(self._args.__dict__)
+        self._rom_paths = frozenset(normpath(rom)
+                                    for rom in self._argdict.get('rom') or [])
+
+    def _get_env_condition(self, name: str) -> bool:
+        try:
+            return self._env_conds[name]
+        except KeyError:
+            pass
+        cond = environ.get(name, '').strip().lower() not in self.FALSE_VALUES
+        self._env_conds[name] = cond
+        return cond
+
     def _build_test_args(self, test_name: str) \
             -> tuple[Namespace, list[str], int]:
         tests_cfg = self._config.get('tests', {})
         if not isinstance(tests_cfg, dict):
             raise ValueError('Invalid tests sub-section')
-        kwargs = dict(self._args.__dict__)
+        base_args = self._args.__dict__
         test_cfg = tests_cfg.get(test_name, {})
         if test_cfg is None:
             # does not default to an empty dict to differenciate empty from
             # inexistent test configuration
             self._log.debug('No configuration for test %s', test_name)
+            kwargs = ChainMap(base_args)
             opts = None
         else:
             test_cfg = {k: v for k, v in test_cfg.items()
@@ -1691,19 +1988,20 @@ def _build_test_args(self, test_name: str) \
             self._log.debug('Using custom test config for %s', test_name)
             discards = {k for k, v in test_cfg.items() if v == ''}
             if discards:
-                test_cfg = dict(test_cfg)
-                for discard in discards:
-                    del test_cfg[discard]
-                    if discard in kwargs:
-                        del kwargs[discard]
-            kwargs.update(test_cfg)
+                test_cfg = {k: v for k, v in test_cfg.items()
+                            if k not in discards}
+                base_args = {k: v for k, v in base_args.items()
+                             if k not in discards}
+            # test configuration overrides default arguments, without copying
+            # the latter for each test
+            kwargs = ChainMap(test_cfg, base_args)
             opts = kwargs.get('opts')
             if opts and not isinstance(opts, list):
                 raise ValueError('fInvalid QEMU options for {test_name}')
-            opts = self.flatten([opt.split(' ') for opt in opts])
-            opts = [self._qfm.interpolate(opt) for opt in opts]
-            opts = self.flatten([opt.split(' ') for opt in opts])
-            opts = [self._qfm.interpolate_dirs(opt, test_name) for opt in opts]
+            qfm = self._qfm
+            opts = [qfm.interpolate_dirs(iopt, test_name)
+                    for opt in opts for sopt in opt.split(' ')
+                    for iopt in qfm.interpolate(sopt).split(' ')]
         timeout = float(kwargs.get('timeout', DEFAULT_TIMEOUT))
         tmfactor = float(kwargs.get('timeout_factor', DEFAULT_TIMEOUT_FACTOR))
         itimeout = int(timeout * tmfactor)
@@ -1711,9 +2009,8 @@ def _build_test_args(self, test_name: str) \
         try:
             texp = int(texpect)
         except ValueError:
-            result_map = {v: k for k, v in self.RESULT_MAP.items()}
             try:
-                texp = result_map[texpect.upper()]
+                texp = self.RESULT_MAP_INV[texpect.upper()]
             except KeyError as exc:
                 raise ValueError(f'Unsupported expect: {texpect}') from exc
         return Namespace(**kwargs), opts or [], itimeout, texp
@@ -1735,8 +2032,8 @@ def _build_test_context(self, test_name: str) -> QEMUContext:
                     if not isinstance(cmd, str):
                         raise ValueError(f'Invalid command #{pos} in '
                                          f'"{ctx_name}" for test {test_name}')
-                    cmd = re.sub(r'[\n\r]', ' ', cmd.strip())
-                    cmd = re.sub(r'\s{2,}', ' ', cmd)
+                    cmd = self.EOL_CRE.sub(' ', cmd.strip())
+                    cmd = self.SPACES_CRE.sub(' ', cmd)
                     cmd = self._qfm.interpolate(cmd)
                     cmd = self._qfm.interpolate_dirs(cmd, test_name)
                     context[ctx_name].append(cmd)
@@ -1745,122 +2042,135 @@ def _build_test_context(self, test_name: str) -> QEMUContext:
                 if not isinstance(env, dict):
                     raise ValueError('Invalid context environment')
                 test_env = {k: self._qfm.interpolate(v) for k, v in env.items()}
+        if context and self._base_env is None:
+            # the environment is shared by all tests
+            self._base_env = QEMUContext.build_base_env(self._qemu_cmd)
         return QEMUContext(test_name, self._qfm, self._qemu_cmd, dict(context),
-                           test_env)
+                           test_env, self._base_env)
+
+
+@lru_cache(maxsize=1)
+def build_arg_parser(qemu_path: Optional[str]) -> ArgumentParser:
+    """Build the command line argument parser.
+
+       :param qemu_path: the default path to the QEMU application, if any
+       :return: the argument parser
+    """
+    desc = sys.modules[__name__].__doc__.split('.', 1)[0].strip()
+    argparser = ArgumentParser(description=f'{desc}.')
+    qvm = argparser.add_argument_group(title='Virtual machine')
+    rel_qemu_path = relpath(qemu_path) if qemu_path else '?'
+    qvm.add_argument('-D', '--start-delay', type=float, metavar='DELAY',
+                     help='QEMU start up delay before initial comm')
+    qvm.add_argument('-i', '--icount',
+                     help='virtual instruction counter with 2^ICOUNT clock '
+                          'ticks per inst. or \'auto\'')
+    qvm.add_argument('-L', '--log_file',
+                     help='log file for trace and log messages')
+    qvm.add_argument('-M', '--variant',
+                     help='machine variant (machine specific)')
+    qvm.add_argument('-N', '--log', action='append',
+                     help='log message types')
+    qvm.add_argument('-m', '--machine',
+                     help=f'virtual machine (default to {DEFAULT_MACHINE})')
+    qvm.add_argument('-Q', '--opts', action='append',
+                     help='QEMU verbatim option (can be repeated)')
+    qvm.add_argument('-q', '--qemu',
+                     help=f'path to qemu application '
+                          f'(default: {rel_qemu_path})')
+    qvm.add_argument('-P', '--vcp', action='append',
+                     help='serial port devices (default: use serial0)')
+    qvm.add_argument('-p', '--device',
+                     help=f'serial port device name / template name '
+                          f'(default to {DEFAULT_DEVICE})')
+    qvm.add_argument('-t', '--trace', type=FileType('rt', encoding='utf-8'),
+                     help='trace event definition file')
+    qvm.add_argument('-S', '--first-soc', default=None,
+                     help='Identifier of the first SoC, if any')
+    qvm.add_argument('-s', '--singlestep', action='store_const',
+                     const=True,
+                     help='enable "single stepping" QEMU execution mode')
+    qvm.add_argument('-U', '--muxserial', action='store_const',
+                     const=True,
+                     help='enable multiple virtual UARTs to be muxed into '
+                          'same host output channel')
+    files = argparser.add_argument_group(title='Files')
+    files.add_argument('-b', '--boot',
+                       metavar='file', help='bootloader 0 file')
+    files.add_argument('-c', '--config', metavar='HJSON',
+                       type=FileType('rt', encoding='utf-8'),
+                       help='path to HJSON configuration file')
+    files.add_argument('-e', '--embedded-flash', action='store_const',
+                       const=True,
+                       help='generate an embedded flash image file')
+    files.add_argument('-f', '--flash', metavar='RAW',
+                       help='SPI flash image file')
+    files.add_argument('-g', '--otcfg', metavar='file',
+                       help='configuration options for OpenTitan devices')
+    files.add_argument('-K', '--keep-tmp', action='store_true',
+                       help='Do not automatically remove temporary files '
+                            'and dirs on exit')
+    files.add_argument('-l', '--loader', metavar='file',
+                       help='ROM trampoline to execute, if any')
+    files.add_argument('-O', '--otp-raw', metavar='RAW',
+                       help='OTP image file')
+    files.add_argument('-o', '--otp', metavar='VMEM', help='OTP VMEM file')
+    files.add_argument('-r', '--rom', metavar='ELF', action='append',
+                       help='ROM file (can be repeated, in load order)')
+    files.add_argument('-w', '--result', metavar='CSV',
+                       help='path to output result file')
+    files.add_argument('-x', '--exec', metavar='file',
+                       help='application to load')
+    files.add_argument('-X', '--rom-exec', action='store_const', const=True,
+                       help='load application as ROM image '
+                            '(default: as kernel)')
+    exe = argparser.add_argument_group(title='Execution')
+    exe.add_argument('-F', '--filter', metavar='TEST', action='append',
+                     help='run tests with matching filter, prefix with "!" '
+                          'to exclude matching tests')
+    exe.add_argument('-k', '--timeout', metavar='SECONDS', type=float,
+                     help=f'exit after the specified seconds '
+                          f'(default: {DEFAULT_TIMEOUT} secs)')
+    exe.add_argument('-z', '--list', action='store_true',
+                     help='show a list of tests to execute and exit')
+    exe.add_argument('-R', '--summary', action='store_true',
+                     help='show a result summary')
+    exe.add_argument('-T', '--timeout-factor', type=float, metavar='FACTOR',
+                     default=DEFAULT_TIMEOUT_FACTOR,
+                     help='timeout factor')
+    exe.add_argument('-Z', '--zero', action='store_true',
+                     help='do not error if no test can be executed')
+    extra = argparser.add_argument_group(title='Extras')
+    extra.add_argument('-v', '--verbose', action='count',
+                       help='increase verbosity')
+    extra.add_argument('-V', '--vcp-verbose', action='count',
+                       help='increase verbosity of QEMU virtual comm ports')
+    extra.add_argument('-d', dest='dbg', action='store_true',
+                       help='enable debug mode')
+    extra.add_argument('--quiet', action='store_true',
+                       help='quiet logging: only be verbose on errors')
+    extra.add_argument('--log-time', action='store_true',
+                       help='show local time in log messages')
+    extra.add_argument('--debug', action='append', metavar='LOGGER',
+                       help='assign debug level to logger(s)')
+    extra.add_argument('--info', action='append', metavar='LOGGER',
+                       help='assign info level to logger(s)')
+    extra.add_argument('--warn', action='append', metavar='LOGGER',
+                       help='assign warning level to logger(s)')
+    return argparser
 
 
 def main():
     """Main routine"""
     debug = True
-    qemu_dir = normpath(joinpath(dirname(dirname(dirname(normpath(__file__))))))
-    qemu_path = normpath(joinpath(qemu_dir, 'build', 'qemu-system-riscv32'))
+    qemu_path = joinpath(QEMU_DIR, 'build', 'qemu-system-riscv32')
     if not isfile(qemu_path):
         qemu_path = None
     tmp_result: Optional[str] = None
     result_file: Optional[str] = None
     try:
         args: Optional[Namespace] = None
-        desc = sys.modules[__name__].__doc__.split('.', 1)[0].strip()
-        argparser = ArgumentParser(description=f'{desc}.')
-        qvm = argparser.add_argument_group(title='Virtual machine')
-        rel_qemu_path = relpath(qemu_path) if qemu_path else '?'
-        qvm.add_argument('-D', '--start-delay', type=float, metavar='DELAY',
-                         help='QEMU start up delay before initial comm')
-        qvm.add_argument('-i', '--icount',
-                         help='virtual instruction counter with 2^ICOUNT clock '
-                              'ticks per inst. or \'auto\'')
-        qvm.add_argument('-L', '--log_file',
-                         help='log file for trace and log messages')
-        qvm.add_argument('-M', '--variant',
-                         help='machine variant (machine specific)')
-        qvm.add_argument('-N', '--log', action='append',
-                         help='log message types')
-        qvm.add_argument('-m', '--machine',
-                         help=f'virtual machine (default to {DEFAULT_MACHINE})')
-        qvm.add_argument('-Q', '--opts', action='append',
-                         help='QEMU verbatim option (can be repeated)')
-        qvm.add_argument('-q', '--qemu',
-                         help=f'path to qemu application '
-                              f'(default: {rel_qemu_path})')
-        qvm.add_argument('-P', '--vcp', action='append',
-                         help='serial port devices (default: use serial0)')
-        qvm.add_argument('-p', '--device',
-                         help=f'serial port device name / template name '
-                              f'(default to {DEFAULT_DEVICE})')
-        qvm.add_argument('-t', '--trace', type=FileType('rt', encoding='utf-8'),
-                         help='trace event definition file')
-        qvm.add_argument('-S', '--first-soc', default=None,
-                         help='Identifier of the first SoC, if any')
-        qvm.add_argument('-s', '--singlestep', action='store_const',
-                         const=True,
-                         help='enable "single stepping" QEMU execution mode')
-        qvm.add_argument('-U', '--muxserial', action='store_const',
-                         const=True,
-                         help='enable multiple virtual UARTs to be muxed into '
-                              'same host output channel')
-        files = argparser.add_argument_group(title='Files')
-        files.add_argument('-b', '--boot',
-                           metavar='file', help='bootloader 0 file')
-        files.add_argument('-c', '--config', metavar='HJSON',
-                           type=FileType('rt', encoding='utf-8'),
-                           help='path to HJSON configuration file')
-        files.add_argument('-e', '--embedded-flash', action='store_const',
-                           const=True,
-                           help='generate an embedded flash image file')
-        files.add_argument('-f', '--flash', metavar='RAW',
-                           help='SPI flash image file')
-        files.add_argument('-g', '--otcfg', metavar='file',
-                           help='configuration options for OpenTitan devices')
-        files.add_argument('-K', '--keep-tmp', action='store_true',
-                           help='Do not automatically remove temporary files '
-                                'and dirs on exit')
-        files.add_argument('-l', '--loader', metavar='file',
-                           help='ROM trampoline to execute, if any')
-        files.add_argument('-O', '--otp-raw', metavar='RAW',
-                           help='OTP image file')
-        files.add_argument('-o', '--otp', metavar='VMEM', help='OTP VMEM file')
-        files.add_argument('-r', '--rom', metavar='ELF', action='append',
-                           help='ROM file (can be repeated, in load order)')
-        files.add_argument('-w', '--result', metavar='CSV',
-                           help='path to output result file')
-        files.add_argument('-x', '--exec', metavar='file',
-                           help='application to load')
-        files.add_argument('-X', '--rom-exec', action='store_const', const=True,
-                           help='load application as ROM image '
-                                '(default: as kernel)')
-        exe = argparser.add_argument_group(title='Execution')
-        exe.add_argument('-F', '--filter', metavar='TEST', action='append',
-                         help='run tests with matching filter, prefix with "!" '
-                              'to exclude matching tests')
-        exe.add_argument('-k', '--timeout', metavar='SECONDS', type=float,
-                         help=f'exit after the specified seconds '
-                              f'(default: {DEFAULT_TIMEOUT} secs)')
-        exe.add_argument('-z', '--list', action='store_true',
-                         help='show a list of tests to execute and exit')
-        exe.add_argument('-R', '--summary', action='store_true',
-                         help='show a result summary')
-        exe.add_argument('-T', '--timeout-factor', type=float, metavar='FACTOR',
-                         default=DEFAULT_TIMEOUT_FACTOR,
-                         help='timeout factor')
-        exe.add_argument('-Z', '--zero', action='store_true',
-                         help='do not error if no test can be executed')
-        extra = argparser.add_argument_group(title='Extras')
-        extra.add_argument('-v', '--verbose', action='count',
-                           help='increase verbosity')
-        extra.add_argument('-V', '--vcp-verbose', action='count',
-                           help='increase verbosity of QEMU virtual comm ports')
-        extra.add_argument('-d', dest='dbg', action='store_true',
-                           help='enable debug mode')
-        extra.add_argument('--quiet', action='store_true',
-                           help='quiet logging: only be verbose on errors')
-        extra.add_argument('--log-time', action='store_true',
-                           help='show local time in log messages')
-        extra.add_argument('--debug', action='append', metavar='LOGGER',
-                           help='assign debug level to logger(s)')
-        extra.add_argument('--info', action='append', metavar='LOGGER',
-                           help='assign info level to logger(s)')
-        extra.add_argument('--warn', action='append', metavar='LOGGER',
-                           help='assign warning level to logger(s)')
+        argparser = build_arg_parser(qemu_path)
 
         try:
             # all arguments after `--` are forwarded to QEMU
@@ -1893,7 +2203,7 @@ def main():
                                 warning=args.warn)[0]
 
         qfm = QEMUFileManager(args.keep_tmp)
-        qfm.set_qemu_src_dir(qemu_dir)
+        qfm.set_qemu_src_dir(QEMU_DIR)
 
         # this is a bit circomvulted, as we need to parse the config filename
         # if any, and load the default values out of the configuration file,
@@ -1923,8 +2233,7 @@ def main():
                         continue
                 optname = f'--{arg}' if len(arg) > 1 else f'-{arg}'
                 if isinstance(val, list):
-                    val = QEMUExecuter.flatten(v.split() for v in val)
-                    for valit in val:
+                    for valit in chain.from_iterable(v.split() for v in val):
                         jargs.append(f'{optname}={qfm.interpolate(valit)}')
                 else:
                     jargs.append(optname)
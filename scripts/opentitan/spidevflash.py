@@ -12,7 +12,7 @@
 from logging import getLogger
 from os import linesep
 from os.path import dirname, join as joinpath, normpath
-from time import sleep, time as now
+from time import time as now
 from traceback import format_exc
 import sys
 
@@ -61,10 +61,11 @@ def program(self, data: memoryview, offset: int = 0):
             page = data[pos:pos+page_size]
             log.debug('Program page @ 0x%06x %d/%d, %d bytes',
                       pos + offset, pos//page_size, page_count, len(page))
-            self._spidev.enable_write()
-            self._spidev.page_program(pos + offset, page)
-            sleep(0.003)
-            self._spidev.wait_idle(pace=0.001)  # bootrom is slow :-)
+            # flash device should be idle before the next page is submitted,
+            # so only the write enable and page program requests are batched
+            self._spidev.page_program(pos + offset, page, enable_write=True)
+            # bootrom is slow :-), back off to avoid flooding it with requests
+            self._spidev.wait_idle(pace=0.002, min_pace=0.0001)
             total += len(page)
         delta = now() - start
         msg = f'{delta:.1f}s to send {total/1024:.1f}KB: ' \
@@ -114,7 +115,8 @@ def main():
 
         flasher = SpiDeviceFlasher()
         flasher.connect(args.host, args.port)
-        data = args.file.read()
+        # pages are sliced from the whole file content without copying them
+        data = memoryview(args.file.read())
         args.file.close()
         flasher.program(data, args.address)
         flasher.disconnect()
@@ -24,6 +24,16 @@
 
 LUI_MASK = (1 << 12) - 1
 
+OPENTITAN_TAIL = spack('<III',
+                       0xc0de05b7,  # lui  a1,0xc0de0  # exit code (0)
+                       0x00b52423,  # sw   a1,8(a0)    # write to sw_fatal_err
+                       0x10500073)  # wfi              # stop here
+
+IBEXDEMO_TAIL = spack('<III',
+                      0x00100593,  # li   a1,1        # set bit 0 to exit
+                      0x00b52423,  # sw   a1,8(a0)    # write to sim_ctrl
+                      0x10500073)  # wfi              # stop here
+
 
 def to_int(value: Union[int, str]) -> int:
     if isinstance(value, int):
@@ -33,22 +43,14 @@ def to_int(value: Union[int, str]) -> int:
 
 def opentitan_code(addr: int) -> bytes:
     addr &= ~LUI_MASK
-    lui = addr | 0x537
-    return spack('<IIII',
-                 lui,         # lui  a0,addr     # ibex_core_wrapper base
-                 0xc0de05b7,  # lui  a1,0xc0de0  # exit code (0)
-                 0x00b52423,  # sw   a1,8(a0)    # write to sw_fatal_err
-                 0x10500073)  # wfi              # stop here
+    lui = addr | 0x537  # lui  a0,addr     # ibex_core_wrapper base
+    return lui.to_bytes(4, 'little') + OPENTITAN_TAIL
 
 
 def ibexdemo_code(addr: int) -> bytes:
     addr &= ~LUI_MASK
-    lui = addr | 0x537
-    return spack('<IIII',
-                 lui,         # lui  a0,addr     # simulator_ctrl base
-                 0x00100593,  # li   a1,1        # set bit 0 to exit
-                 0x00b52423,  # sw   a1,8(a0)    # write to sim_ctrl
-                 0x10500073)  # wfi              # stop here
+    lui = addr | 0x537  # lui  a0,addr     # simulator_ctrl base
+    return lui.to_bytes(4, 'little') + IBEXDEMO_TAIL
 
 
 def main():
@@ -77,9 +79,13 @@ def main():
         else:
             bincode = opentitan_code(addr)
         out = args.output or sys.stdout.buffer
-        padding = bytes(args.base)
-        out.write(padding)
-        out.write(bincode)
+        if out is not sys.stdout.buffer and out.seekable():
+            # the output file has just been created, skip over the padding
+            out.seek(args.base)
+            out.write(bincode)
+        else:
+            # the standard output may be appended to, padding is required
+            out.write(b''.join((bytes(args.base), bincode)))
 
     # pylint: disable=broad-except
     except Exception as exc:
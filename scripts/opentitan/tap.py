@@ -10,11 +10,12 @@
 
 from argparse import ArgumentParser
 from enum import IntEnum
-from logging import getLogger
+from itertools import chain
+from logging import DEBUG, INFO, getLogger
 from os.path import dirname, join as joinpath, normpath
-from socket import create_server, socket, SHUT_RDWR
+from socket import create_server, socket, IPPROTO_TCP, TCP_NODELAY
 from traceback import format_exc
-from typing import Optional
+from typing import Callable, Optional
 import sys
 
 QEMU_PYPATH = joinpath(dirname(dirname(dirname(normpath(__file__)))),
@@ -55,7 +56,12 @@ class TAPRegister:
 
     def __init__(self, name: str, length: int, reset: int):
         self._log = getLogger(f'tap.{name}')
+        # log levels are evaluated once, as registers are shifted on each
+        # clock cycle
+        self._debug = self._log.isEnabledFor(DEBUG)
+        self._info = self._log.isEnabledFor(INFO)
         self._length = length
+        self._msb = 1 << (length - 1)
         self._reset = reset
         self._reg = self._reset
 
@@ -71,15 +77,17 @@ def reset(self):
 
     def capture(self):
         self._reg = self._reset
-        self._log.info('capture %s', self.binstr(self._reg))
+        if self._info:
+            self._log.info('capture %s', self.binstr(self._reg))
 
     def shift(self, tdi: bool):
-        self._reg >>= 1
-        self._reg |= int(tdi) << (self._length-1)
-        self._log.debug('tdi:%u -> %s', tdi, self.binstr(self._reg))
+        self._reg = (self._reg >> 1) | (self._msb if tdi else 0)
+        if self._debug:
+            self._log.debug('tdi:%u -> %s', tdi, self.binstr(self._reg))
 
     def update(self):
-        self._log.info('update %s', self.binstr(self._reg))
+        if self._info:
+            self._log.info('update %s', self.binstr(self._reg))
 
 
 class TAP_BYPASS(TAPRegister):
@@ -133,7 +141,8 @@ def capture(self):
         self._reg = self._reset | (self._dmistat << 10)
 
     def update(self):
-        self._log.debug('%s', self.binstr(self._reg))
+        if self._debug:
+            self._log.debug('%s', self.binstr(self._reg))
         dmireset = bool((self._reg >> 16) & 0xb1)
         dmihardreset = bool((self._reg >> 17) & 0xb1)
         if dmireset:
@@ -183,8 +192,12 @@ class TAPController:
             (TAPState.RUN_TEST_IDLE, TAPState.SELECT_DR_SCAN)
     }
 
+    # flat transition table, indexed with (state << 1) | tms
+    NEXT_STATES = tuple(chain.from_iterable(map(STATES.__getitem__, TAPState)))
+
     def __init__(self, irlength: int, ext: Optional['TAPExtension'] = None):
         self._log = getLogger('tap.ctrl')
+        self._debug = self._log.isEnabledFor(DEBUG)
         self._trst = False
         self._srst = False
         self._tck = False
@@ -197,10 +210,18 @@ def __init__(self, irlength: int, ext: Optional['TAPExtension'] = None):
         self._state = TAPState.RUN_TEST_IDLE
         self._bypass = TAP_BYPASS()
         self._idcode = TAP_IDCODE(0x04f5484d)
+        # clock falling edge actions, indexed by TAP state
+        self._actions: list[Optional[Callable]] = [None] * len(TAPState)
+        self._actions[TAPState.TEST_LOGIC_RESET] = self._reset
+        self._actions[TAPState.CAPTURE_DR] = self._capture_ir_dr
+        self._actions[TAPState.SHIFT_DR] = self._output_dr
+        self._actions[TAPState.UPDATE_DR] = self._update_dr
+        self._actions[TAPState.SHIFT_IR] = self._output_ir
+        self._actions[TAPState.UPDATE_IR] = self._ir.update
         self._reset()
 
     def _next(self, tms: bool) -> TAPState:
-        self._state = self.STATES[self._state][int(tms)]
+        self._state = self.NEXT_STATES[(self._state << 1) | tms]
         return self._state
 
     def _reset(self):
@@ -217,27 +238,32 @@ def _step(self, tck: bool, tms: bool, tdi: bool):
                 self._dr.shift(self._tdi)
             old = self._state
             new = self._next(self._tms)
-            self._log.debug('State %s -> %s', old, new)
-        else:
-            # Clock falling edge
-            if self._state == TAPState.RUN_TEST_IDLE:
-                pass
-            elif self._state == TAPState.TEST_LOGIC_RESET:
-                self._reset()
-            elif self._state == TAPState.CAPTURE_DR:
-                self._capture_dr(self._ir.value)
-            elif self._state == TAPState.SHIFT_DR:
-                self._tdo = self._dr.value & 0b1
-            elif self._state == TAPState.UPDATE_DR:
-                self._dr.update()
-            elif self._state == TAPState.SHIFT_IR:
-                self._tdo = self._ir.value & 0b1
-            elif self._state == TAPState.UPDATE_IR:
-                self._ir.update()
+            if self._debug:
+                self._log.debug('State %s -> %s', old, new)
+            # Clock falling edge actions of the new state only depend on the
+            # state and the registers, which cannot change till the next
+            # falling edge: perform them right away, so that the falling edge
+            # only needs to latch TMS and TDI, and each state action is only
+            # executed once.
+            action = self._actions[new]
+            if action:
+                action()
         self._tck = tck
         self._tdi = tdi
         self._tms = tms
 
+    def _capture_ir_dr(self):
+        self._capture_dr(self._ir.value)
+
+    def _output_dr(self):
+        self._tdo = self._dr.value & 0b1
+
+    def _update_dr(self):
+        self._dr.update()
+
+    def _output_ir(self):
+        self._tdo = self._ir.value & 0b1
+
     def _capture_dr(self, value: int):
         old_dr = self._dr
         if value in (0x00, 0x1f):
@@ -280,53 +306,74 @@ class BitBangController(TAPController):
 
     IR_LENGTH = 0x5
 
+    RECV_SIZE = 4096
+
     def __init__(self, *args, **kwargs):
         super().__init__(self.IR_LENGTH, *args, **kwargs)
         self._socket: Optional[socket] = None
         self._resume = False
+        # request handlers and their arguments, indexed by request byte
+        self._dispatch: list[Optional[tuple[Callable, tuple]]] = [None] * 256
+        for req, (command, cargs) in self.BB_MAP.items():
+            handler = getattr(self, f'_inject_{command}', None)
+            if handler is None:
+                handler, cargs = self._inject_unimplemented, (command,)
+            self._dispatch[req[0]] = (handler, cargs)
         self._reset()
 
     def run(self, port: int):
+        # the server socket is already listening once created
         self._socket = create_server(('localhost', port), reuse_port=True)
-        while True:
-            self._socket.listen(0)
-            self._resume = True
-            while self._resume:
+        try:
+            while True:
                 peer, addr = self._socket.accept()
+                # TDO replies are small, do not let them wait for more data
+                peer.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                self._resume = True
                 with peer:
                     self._log.info('Connection from %s:%d', *addr)
-                    while True:
-                        req = peer.recv(1)
-                        if not req:
+                    out = bytearray()
+                    # a quit request terminates the current session, the
+                    # next connection is then awaited
+                    while self._resume:
+                        # handle all the pending requests at once, and reply
+                        # to all their read requests with a single send
+                        reqs = peer.recv(self.RECV_SIZE)
+                        if not reqs:
                             break
-                        resp = self._inject(req)
-                        if resp is not None:
-                            out = bytes((0x30 + int(resp),))
-                            self._log.debug('Out %s', out)
-                            peer.send(out)
-        self._socket.shutdown(SHUT_RDWR)
-        self._socket = None
-
-    def _inject(self, req: bytes) -> Optional[bool]:
-        self._log.debug('[%s]', req.decode())
-        try:
-            command, args = self.BB_MAP[req]
-        except KeyError:
-            self._log.error('Unknown input [%s]', req)
+                        for req in reqs:
+                            resp = self._inject(req)
+                            if resp is not None:
+                                out.append(0x31 if resp else 0x30)  # '1'/'0'
+                        if out:
+                            if self._debug:
+                                self._log.debug('Out %s', bytes(out))
+                            peer.sendall(out)
+                            out.clear()
+        finally:
+            self._socket.close()
+            self._socket = None
+
+    def _inject(self, req: int) -> Optional[bool]:
+        if self._debug:
+            self._log.debug('[%c]', req)
+        entry = self._dispatch[req]
+        if entry is None:
+            self._log.error('Unknown input [%s]', bytes((req,)))
             return None
-        handler = getattr(self, f'_inject_{command}', None)
-        if handler is None:
-            self._log.warning('Unimplemented handler for %s', command)
-            return None
-        # pylint: disable=not-callable
+        handler, args = entry
         return handler(*args)
 
+    def _inject_unimplemented(self, command: str):
+        self._log.warning('Unimplemented handler for %s', command)
+
     def _inject_quit(self):
         self._log.info('Quit')
         self._resume = False
 
     def _inject_blink(self, enable: bool):
-        self._log.debug('Blink %u', enable)
+        if self._debug:
+            self._log.debug('Blink %u', enable)
 
     def _inject_reset(self, trst: bool, srst: bool):
         if trst != self._trst:
@@ -337,11 +384,13 @@ def _inject_reset(self, trst: bool, srst: bool):
         self._trst, self._srst = trst, srst
 
     def _inject_read(self) -> bool:
-        self._log.debug('TDO %u', self._tdo)
+        if self._debug:
+            self._log.debug('TDO %u', self._tdo)
         return self._tdo
 
     def _inject_write(self, tck: bool, tms: bool, tdi: bool):
-        self._log.debug('TCK %u TMS %u TDI %u', tck, tms, tdi)
+        if self._debug:
+            self._log.debug('TCK %u TMS %u TDI %u', tck, tms, tdi)
         self._step(tck, tms, tdi)
 
 
@@ -431,16 +480,23 @@ class CmdErr(IntEnum):
     DATABASE = 0x4
     PROGBUFBASE = 0x20
 
+    DATA_MASK = (1 << 32) - 1
+    ADDR_SHIFT = 32 + 2  # address field, above data and op fields
+
     DATACOUNT = 10
     PROGBUFSIZE = 8
 
+    OP_NOP, OP_READ, OP_WRITE = range(3)
+    OP_NAMES = ('nop', 'read', 'write', 'rsv')
+
     # RV32IMC
     RV32 = 0b01 << 30
     MISA = RV32 | isa('I') | isa('M') | isa('C')
 
     def __init__(self, abits: int):
-        super().__init__('dmi', 32 + 2 + abits, 0)
+        super().__init__('dmi', self.ADDR_SHIFT + abits, 0)
         self._abits = abits
+        self._addr_mask = (1 << abits) - 1
         self._addr = 0
         self._registers = {reg: 0 for reg in self.DM_REGISTERS}
         self._is_halted = False
@@ -449,11 +505,26 @@ def __init__(self, abits: int):
         self._data = [0] * self.DATACOUNT
         self._progbuf = [0] * self.PROGBUFSIZE
         self._cmderr = TAP_DMI.CmdErr.NONE
+        # last captured value, valid until a DM request is handled
+        self._captured = 0
+        self._dirty = True
+        # register access handlers, indexed by (address, operation)
+        self._handlers = {}
+        for addr, regname in self.DM_REGISTERS.items():
+            for op in (self.OP_READ, self.OP_WRITE):
+                opname = self.OP_NAMES[op]
+                handler = getattr(self, f'_{regname}_{opname}', None)
+                if handler:
+                    self._handlers[(addr, op)] = handler
 
     def hardreset(self):
         self._log.warning('HARD RESET')
 
     def capture(self):
+        if not self._dirty:
+            # debugger is polling a register which has not been altered
+            self._reg = self._captured
+            return
         addr = self._addr
         regname = self.DM_REGISTERS.get(addr)
         if 0 <= addr-self.DATABASE < self.DATACOUNT:
@@ -462,18 +533,21 @@ def capture(self):
             data = self._progbuf[addr-self.PROGBUFBASE]
         else:
             data = self._registers.get(addr, 0)
-        self._reg = addr << (32 + 2) | (data << 2)
-        self._log.info('%s @ 0x%02x = 0x%08x', regname, addr, data)
+        self._reg = addr << self.ADDR_SHIFT | (data << 2)
+        self._captured = self._reg
+        self._dirty = False
+        if self._info:
+            self._log.info('%s @ 0x%02x = 0x%08x', regname, addr, data)
 
     def update(self):
-        opname = {
-            0: 'nop', 1: 'read', 2: 'write', 3: 'rsv'
-        }.get(self.value & 0b11)
-        if opname == 'nop':
+        op = self.value & 0b11
+        if op == self.OP_NOP:
             return
-        addr = self.value >> (32 + 2) & ((1 << self._abits) - 1)
-        data = (self.value >> 2) & ((1 << 32) - 1)
-        write = opname == 'write'
+        # any access may change the address or the content of a register
+        self._dirty = True
+        addr = self._reg >> self.ADDR_SHIFT & self._addr_mask
+        data = (self._reg >> 2) & self.DATA_MASK
+        write = op == self.OP_WRITE
         self._addr = addr
         if 0 <= addr-self.DATABASE < self.DATACOUNT:
             if write:
@@ -486,13 +560,12 @@ def update(self):
         regname = self.DM_REGISTERS.get(addr)
         if regname is None:
             self._log.warning('Unsupported DM register 0x%02x', addr)
-        else:
+        elif self._info:
             self._log.info('%s @ %s [%02x]%s',
-                           opname, regname, addr,
+                           self.OP_NAMES[op], regname, addr,
                            f' {data:08x}' if write else '')
-        handler = getattr(self, f'_{regname}_{opname}', None)
+        handler = self._handlers.get((addr, op))
         if handler:
-            # pylint: disable=not-callable
             handler(data)
 
     def _dmcontrol_write(self, value: int):
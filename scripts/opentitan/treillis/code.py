@@ -16,7 +16,8 @@
 # pylint: disable=attribute-defined-outside-init
 
 try:
-    from time import monotonic_ns as now
+    from array import array
+    from time import monotonic_ns as now, sleep
     import usb_cdc
     from adafruit_trellism4 import TrellisM4Express
 except ImportError:
@@ -41,6 +42,16 @@ class OtGPIO:
 
     LOCK_TIME_MS = 300   # key depressed time to lock/unlock an input key
 
+    IDLE_TIME = 0.001  # delay between key scans w/o serial data (seconds)
+
+    MASK = (1 << 32) - 1  # 32-bit bitmaps
+
+    BIT_POS = {1 << pos: pos for pos in range(32)}  # bit value to position
+
+    # (x, y) key coordinates to input bit value
+    KEY_BITS = {(x, y): 1 << (31 - (8 * y + x))
+                for y in range(4) for x in range(8)}
+
     def __init__(self, serial):
         self._serial = serial
         self._trellis = TrellisM4Express()
@@ -49,8 +60,12 @@ def __init__(self, serial):
         self._trellis.pixels.auto_write = False
         pixels = self._trellis.pixels
         self._cache = [(0, 0, 0)] * pixels.width * pixels.height
+        lastpix = len(self._cache) - 1  # pixel index of GPIO 0
+        # bit value to pixel index
+        self._bit_pixel = {1 << pos: lastpix - pos for pos in range(32)}
         # bypass the Adafruit API which is far too slow
         self._neopixels = pixels._neopixel
+        self._dirty = False  # whether some pixels need to be shown
         self._wipe()
 
     def _wipe(self):
@@ -60,34 +75,43 @@ def _wipe(self):
         self._hiz = 0xfffffff  # high-Z
         self._wpud = 0  # weak pull (1: up 0: down)
         self._inact = 0  # input activated
+        # input mask message (to peer)
+        self._inact_msg = b'M:%08x\r\n' % self.MASK
         self._in = 0  # input value (to peer)
+        self._in_msg = b'I:00000000\r\n'  # input value message (to peer)
         self._kin = 0  # keyboard input
         pixels = self._trellis.pixels
         self._cache = [(0, 0, 0)] * pixels.width * pixels.height
         self._lock_in = 0  # locked keys
-        self._lock_time = {}  # when key has been first pressed (ns timestamp)
+        # when key has been first pressed (ns timestamp, 0: not pressed)
+        self._lock_time = array('q', [0] * 32)
 
     def _update_input(self, newval, force=False):
         # pylint: disable=unused-argument
         ts = now()
         change = self._kin ^ newval
-        self._inact |= change
+        inact = self._inact | change
+        if inact != self._inact:
+            # only format the input mask message when the mask changes
+            self._inact = inact
+            self._inact_msg = b'M:%08x\r\n' % (~inact & self.MASK)
         self._kin = newval
         # handle flip-flop: if a key is pressed long enough, its new value
         # is stored
-        for pos in range(32):
-            bit = 1 << pos
-            # only consider keys that change
-            if not bit & change:
-                continue
+        # only consider keys that change, i.e. iterate over set bits only
+        pending = change
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            pos = self.BIT_POS[bit]
             # is the key down?
             down = bool(bit & newval)
             if down:
                 self._lock_time[pos] = ts
                 continue
             # key is released
-            dtime = self._lock_time.get(pos)
-            if dtime is None:
+            dtime = self._lock_time[pos]
+            if not dtime:
                 continue
             delay_ms = (ts - dtime) // 1_000_000
             if delay_ms > self.LOCK_TIME_MS:
@@ -97,8 +121,12 @@ def _update_input(self, newval, force=False):
                     self._lock_in &= ~bit
                 else:
                     self._lock_in |= bit
-                self._lock_time.pop(pos)
-        self._in = self._lock_in ^ newval
+                self._lock_time[pos] = 0
+        inval = self._lock_in ^ newval
+        if inval != self._in:
+            # only format the input message when the input value changes
+            self._in = inval
+            self._in_msg = b'I:%08x\r\n' % inval
         return change
 
     def _update_output(self, newval):
@@ -107,46 +135,52 @@ def _update_output(self, newval):
         return change
 
     def _refresh_input(self, update):
-        lastpix = len(self._cache) - 1
-        for pos in range(32):
-            bit = 1 << pos
-            if not bit & update:
-                continue
-            if self._inact & bit:
-                if self._in & bit:
-                    color = self.GPI_ON
-                else:
-                    color = self.GPI_OFF
-            else:
-                if self._hiz & bit:
-                    color = self.GP_HIZ
-                else:
-                    if self._wpud & bit:
-                        color = self.GP_PU
-                    else:
-                        color = self.GP_PD
-            pixel = lastpix - pos
-            if self._cache[pixel] != color:
-                self._neopixels[pixel] = color
-                self._cache[pixel] = color
+        inact = self._inact
+        inval = self._in
+        hiz = self._hiz
+        wpud = self._wpud
+        # update may be a negative, inverted bitmap
+        update &= self.MASK
+        # split updated inputs by color, so that no per-bit test is needed
+        active = update & inact
+        passive = update & ~inact
+        weak = passive & ~hiz
+        dirty = self._paint(active & inval, self.GPI_ON)
+        dirty |= self._paint(active & ~inval, self.GPI_OFF)
+        dirty |= self._paint(passive & hiz, self.GP_HIZ)
+        dirty |= self._paint(weak & wpud, self.GP_PU)
+        dirty |= self._paint(weak & ~wpud, self.GP_PD)
+        if dirty:
+            # flag pending pixels once, rather than on each pixel change
+            self._dirty = True
 
     def _refresh_output(self, update):
-        lastpix = len(self._cache) - 1
-        for pos in range(32):
-            bit = 1 << pos
-            if not update & bit:
-                continue
-            if self._out & bit:
-                color = self.GPO_ON
-            else:
-                color = self.GPO_OFF
-            pixel = lastpix - pos
-            if self._cache[pixel] != color:
-                self._neopixels[pixel] = color
-                self._cache[pixel] = color
+        out = self._out
+        update &= self.MASK
+        dirty = self._paint(update & out, self.GPO_ON)
+        dirty |= self._paint(update & ~out, self.GPO_OFF)
+        if dirty:
+            self._dirty = True
+
+    def _paint(self, bitmap, color):
+        # resolve attributes once, lookups are expensive with CircuitPython
+        bit_pixel = self._bit_pixel
+        cache = self._cache
+        neopixels = self._neopixels
+        dirty = False
+        while bitmap:
+            bit = bitmap & -bitmap
+            bitmap ^= bit
+            pixel = bit_pixel[bit]
+            if cache[pixel] != color:
+                neopixels[pixel] = color
+                cache[pixel] = color
+                dirty = True
+        return dirty
 
     def run(self):
-        self._serial.timeout = 0.005
+        # never block on serial input, so that keys are scanned without delay
+        self._serial.timeout = 0
         self._serial.write_timeout = 0.5
         # query QEMU to repeat I/O config on startup.
         self._serial.write(b'R:00000000\r\n')
@@ -154,74 +188,88 @@ def run(self):
         last_kin = 0
         last_kact = 0
         force = False
-        change = False
+        # resolve attributes once, lookups are expensive with CircuitPython
+        serial = self._serial
+        serial_read = serial.read
+        serial_write = serial.write
+        # pressed_keys is a property, which needs to be re-evaluated each time
+        trellis = self._trellis
+        show = self._neopixels.show
+        refresh_in = self._refresh_input
+        refresh_out = self._refresh_output
+        update_in = self._update_input
+        update_out = self._update_output
+        idle_time = self.IDLE_TIME
+        key_bits = self.KEY_BITS
         while True:
-            if change:
-                self._trellis.pixels.show()
-                change = False
+            if self._dirty:
+                # show all the pixels updated by the last event at once
+                show()
+                self._dirty = False
             kin = 0
-            for x, y in self._trellis.pressed_keys:
-                kin |= 1 << (31 - (8 * y + x))
+            for key in trellis.pressed_keys:
+                kin |= key_bits[key]
             if last_kin != kin:
-                change = self._update_input(kin)
+                change = update_in(kin)
                 if not force:
                     change &= ~self._oe
-                self._refresh_input(change)
+                refresh_in(change)
                 if last_kact != self._inact:
-                    self._serial.write(b'M:%08x\r\n' % ~self._inact)
+                    # send both messages at once, as a single USB transfer
+                    serial_write(self._inact_msg + self._in_msg)
                     last_kact = self._inact
-                self._serial.write(b'I:%08x\r\n' % self._in)
+                else:
+                    serial_write(self._in_msg)
             last_kin = kin
-            data = self._serial.read()
-            if not data:
-                self._serial.timeout = 0.005
-                continue
-            self._serial.timeout = 0
-            for b in data:
-                if b != 0x0d:
-                    buf.append(b)
-            pos = buf.find(b'\n')
-            if pos < 0:
+            pending = serial.in_waiting
+            if not pending:
+                sleep(idle_time)
                 continue
-            line = bytes(buf[:pos])
-            buf = buf[pos+1:]
-            if not line:
-                continue
-            if len(line) < 2 or line[1] != ord(':'):
-                continue
-            cmd = line[0]
-            try:
-                val = int(line[2:], 16)
-            except ValueError:
-                continue
-            change = True
-            if cmd == ord('D'):
-                # update I/O direction
-                self._oe = val
-                self._refresh_output(self._oe)
-                self._refresh_input(~self._oe)
-            elif cmd == ord('O'):
-                # update output
-                change = self._update_output(val)
-                self._refresh_output(change)
-            elif cmd == ord('Z'):
-                # update high-z
-                self._hiz = val
-                self._refresh_input(~self._oe)
-            elif cmd == ord('P'):
-                # update pull-up/pull-down
-                self._wpud = val
-                self._refresh_input(~self._oe)
-            elif cmd == ord('C'):
-                self._wipe()
-                self._refresh_output(self._oe)
-                self._refresh_input(~self._oe)
-            elif cmd == ord('Q'):
-                # QEMU query for current Input state
-                self._serial.write(b'M:%08x\r\n' % ~self._inact)
-                self._serial.write(b'I:%08x\r\n' % self._in)
-            else:
-                print('Unknown command %s' % cmd)
+            data = serial_read(pending)
+            # discard CR chars at once, rather than filtering each byte
+            buf.extend(data.replace(b'\r', b''))
+            # several commands may have been received at once
+            while True:
+                pos = buf.find(b'\n')
+                if pos < 0:
+                    break
+                line = bytes(buf[:pos])
+                buf = buf[pos+1:]
+                if not line:
+                    continue
+                if len(line) < 2 or line[1] != ord(':'):
+                    continue
+                cmd = line[0]
+                try:
+                    val = int(line[2:], 16)
+                except ValueError:
+                    continue
+                if cmd == ord('D'):
+                    # update I/O direction
+                    self._oe = val
+                    refresh_out(self._oe)
+                    refresh_in(~self._oe)
+                elif cmd == ord('O'):
+                    # update output
+                    change = update_out(val)
+                    refresh_out(change)
+                elif cmd == ord('Z'):
+                    # update high-z
+                    self._hiz = val
+                    refresh_in(~self._oe)
+                elif cmd == ord('P'):
+                    # update pull-up/pull-down
+                    self._wpud = val
+                    refresh_in(~self._oe)
+                elif cmd == ord('C'):
+                    self._wipe()
+                    refresh_out(self._oe)
+                    refresh_in(~self._oe)
+                elif cmd == ord('Q'):
+                    # QEMU query for current Input state
+                    serial_write(self._inact_msg + self._in_msg)
+                else:
+                    print('Unknown command %s' % cmd)
 
 
 if __name__ == '__main__':
@@ -9,11 +9,11 @@
 """
 
 from argparse import ArgumentParser
-from collections import deque
 from logging import getLogger
 from os.path import dirname, join as joinpath, normpath
+from queue import Empty, Queue
 from socketserver import StreamRequestHandler, ThreadingTCPServer
-from threading import Event, Lock, Thread
+from threading import Lock, Thread
 from traceback import format_exc
 from typing import Optional, TextIO
 import sys
@@ -29,8 +29,12 @@ class UartHandler(StreamRequestHandler):
     """Handle a single QEMU output stream.
     """
 
+    RECV_SIZE = 4096  # max. size of a single socket read
+
     def __init__(self, *args, **kwargs):
         self._buffer = bytearray()
+        # reuse the same staging buffer for all socket reads
+        self._stage = memoryview(bytearray(self.RECV_SIZE))
         self._id = - 1
         self._log = None
         # init calls handle immediately, so local attributes need to be
@@ -52,24 +56,28 @@ def handle(self):
         try:
             while self.server.resume:
                 try:
-                    rdata = self.request.recv(1024)
+                    rlen = self.request.recv_into(self._stage)
                 except TimeoutError:
                     continue
                 except ConnectionResetError:
                     break
-                if not rdata:
+                if not rlen:
                     # blocking socket reading nothing: client is disconnected
                     break
-                self._buffer.extend(rdata)
-                while self._buffer:
-                    self._log.debug('buf: %d', len(self._buffer))
-                    pos = self._buffer.find(b'\n')
+                self._buffer.extend(self._stage[:rlen])
+                start = 0
+                while True:
+                    self._log.debug('buf: %d', len(self._buffer) - start)
+                    pos = self._buffer.find(b'\n', start)
                     self._log.debug('pos %d', pos)
                     if pos < 0:
                         break
-                    line = bytes(self._buffer[:pos+1])
-                    self._buffer[:] = self._buffer[pos+1:]
+                    line = bytes(self._buffer[start:pos+1])
+                    start = pos+1
                     self.server.push(self._id, line)
+                # discard all consumed lines at once, rather than moving the
+                # buffer tail for each line
+                del self._buffer[:start]
         except Exception as exc:
             if self.server.debug:
                 print(format_exc(chain=False), file=sys.stderr)
@@ -87,11 +95,15 @@ class UartMuxer(ThreadingTCPServer):
     daemon_threads = True
     allow_reuse_address = True
     timeout = None
+    # QEMU may connect all its UART streams at once
+    request_queue_size = 64
 
     COLOR_PREFIX = '\x1b['
     COLOR_SUFFIX = ';1m'
     RESET = '\x1b[0m'
 
+    BATCH_SIZE = 64  # max. count of lines emitted with a single write
+
     def __init__(self, addr: tuple[str, int], out: TextIO, debug: bool = False,
                  separator: Optional[str] = None):
         super().__init__(addr, UartHandler)
@@ -100,13 +112,14 @@ def __init__(self, addr: tuple[str, int], out: TextIO, debug: bool = False,
         self._log = getLogger('mux.muxer')
         self._runner = Thread(target=self._pop, daemon=True)
         self._resume = False
-        self._que: deque[tuple[int, bytes]] = deque()
-        self._evt = Event()
+        self._que: Queue[tuple[int, bytes]] = Queue()
         self._lock = Lock()
         self._handlers: list[UartHandler] = []
         self._discarded: set[UartHandler] = set()
         self._channel_count = 1
         self._channels: list[str] = []
+        self._prefixes: dict[int, str] = {}
+        self._raw_prefixes: dict[int, bytes] = {}
         self._use_color = out.isatty()
         if separator:
             sep = separator if ' ' in separator else (separator * 80)[:80]
@@ -129,7 +142,8 @@ def resume(self, value: bool):
         value = bool(value)
         if self._resume and not value:
             self._resume = value
-            self._evt.set()
+            # wake up the consumer thread, which blocks on the queue
+            self._que.put((-1, b''))
             self.shutdown()
         else:
             self._resume = value
@@ -138,6 +152,8 @@ def run(self, channel_count: int, channels: list[str]) -> None:
         """Start listening on QEMU streams."""
         self._channel_count = min(channel_count, 8)
         self._channels = channels
+        self._prefixes.clear()
+        self._raw_prefixes.clear()
         self._resume = True
         self._runner.start()
         try:
@@ -148,17 +164,20 @@ def run(self, channel_count: int, channels: list[str]) -> None:
 
     def push(self, uart_id: int, line: bytes) -> None:
         """Push a new log message line from one of the QEMU stream listeners."""
-        self._que.append((uart_id, line))
-        self._evt.set()
+        self._que.put((uart_id, line))
 
-    def get_id(self, uart_handler: UartHandler) -> None:
+    def get_id(self, uart_handler: UartHandler) -> int:
         """Get/assign a unique identifier to a listener."""
         with self._lock:
             if self._sep and not self._handlers:
                 self._out.write(self._sep)
-            if uart_handler not in self._handlers:
+                # lines may be written to the underlying binary stream
+                self._out.flush()
+            try:
+                return self._handlers.index(uart_handler)
+            except ValueError:
                 self._handlers.append(uart_handler)
-            return self._handlers.index(uart_handler)
+                return len(self._handlers) - 1
 
     def discard(self, uart_handler: UartHandler) -> None:
         """Called when a listener terminates."""
@@ -178,30 +197,79 @@ def discard(self, uart_handler: UartHandler) -> None:
                 self._log.debug('All clients flushed')
 
     def _pop(self) -> None:
+        # select the output formatter once, rather than on each line
+        raw = getattr(self._out, 'buffer', None)
+        flush = None
+        if raw is not None:
+            # no decoding required, output lines as they are received
+            write = raw.write
+            if self._use_color:
+                build = self._build_colored_raw
+                # binary stream is not line buffered, while a terminal
+                # should show lines as soon as they are received
+                flush = raw.flush
+            else:
+                build = self._build_raw
+        else:
+            write = self._out.write
+            build = self._build_colored if self._use_color else \
+                self._build_plain
         try:
             while self._resume:
-                if not self._que:
-                    if not self._evt.wait(0.1):
-                        continue
-                    self._evt.clear()
-                if self._resume and self._que:
-                    uid, byteline = self._que.popleft()
-                    line = byteline.decode(errors='ignore')
-                    if uid < len(self._channels):
-                        name = f'{self._channels[uid]}: '
-                    else:
-                        name = ''
-                    if self._use_color:
-                        clr = uid % self._channel_count + 31
-                        ansi = f'{self.COLOR_PREFIX}{clr:d}{self.COLOR_SUFFIX}'
-                        # self._log.error('ANSI %s', ansi)
-                        self._out.write(f'{name}{ansi}{line}{self.RESET}')
-                        # raise ValueError()
-                    else:
-                        self._out.write(line)
+                # wait for a line, then emit all pending ones at once
+                entries = [self._que.get()]
+                try:
+                    while len(entries) < self.BATCH_SIZE:
+                        entries.append(self._que.get_nowait())
+                except Empty:
+                    pass
+                if not self._resume:
+                    break
+                write(build(entries))
+                if flush:
+                    flush()
         finally:
             self.resume = False
 
+    def _build_colored(self, entries: list[tuple[int, bytes]]) -> str:
+        parts = []
+        for uid, byteline in entries:
+            prefix = self._prefixes.get(uid)
+            if prefix is None:
+                prefix = self._build_prefix(uid)
+                self._prefixes[uid] = prefix
+            parts.extend((prefix, byteline.decode(errors='ignore'),
+                          self.RESET))
+        return ''.join(parts)
+
+    def _build_colored_raw(self, entries: list[tuple[int, bytes]]) -> bytes:
+        parts = []
+        reset = self.RESET.encode()
+        for uid, byteline in entries:
+            prefix = self._raw_prefixes.get(uid)
+            if prefix is None:
+                prefix = self._build_prefix(uid).encode()
+                self._raw_prefixes[uid] = prefix
+            parts.extend((prefix, byteline, reset))
+        return b''.join(parts)
+
+    @staticmethod
+    def _build_plain(entries: list[tuple[int, bytes]]) -> str:
+        return b''.join(byteline for _, byteline in entries).decode(
+            errors='ignore')
+
+    @staticmethod
+    def _build_raw(entries: list[tuple[int, bytes]]) -> bytes:
+        return b''.join(byteline for _, byteline in entries)
+
+    def _build_prefix(self, uid: int) -> str:
+        if uid < len(self._channels):
+            name = f'{self._channels[uid]}: '
+        else:
+            name = ''
+        clr = uid % self._channel_count + 31
+        return f'{name}{self.COLOR_PREFIX}{clr:d}{self.COLOR_SUFFIX}'
+
 
 def main():
     """Main routine"""